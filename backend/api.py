@@ -1,8 +1,12 @@
 from dotenv import load_dotenv
 from flask import Flask, Response, request, jsonify, abort
 from flask_cors import CORS
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
-from rag.llm import generate_response
+from rag.clients import lazy_import
+from rag.scheduler import QueueFullError, QueuePosition, scheduler
+from rag.session_registry import session_registry
+from rag.warmup import recent_projects, start_warmup, warmup
 
 import datetime
 import jwt
@@ -18,10 +22,6 @@ MMT_HOST = os.getenv("HOST", "localhost") # MMT_HOST = Host of the front-end mod
 app = Flask(__name__)
 CORS(app, origins=[f"http://{MMT_HOST}:5173", f"http://{MMT_HOST}"])
 
-# Keys are session IDs, values are a last seen -timestamp.
-# TODO A way to remove inactive sessions.
-sessions = {}
-
 
 def generate_jwt_token(existing_session_id: str=None) -> str:
     """Generates a JWT token. Tokens are used for identifying front-end sessions.
@@ -35,62 +35,197 @@ def generate_jwt_token(existing_session_id: str=None) -> str:
     session_id = existing_session_id if existing_session_id else str(uuid.uuid4())
     expiration = datetime.datetime.utcnow() + datetime.timedelta(minutes=30)
     
-    sessions[session_id] = datetime.datetime.utcnow()
+    session_registry.touch(session_id)
     token = jwt.encode({"session_id": session_id, "exp": expiration}, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
-@app.route('/start_session', methods = ['GET'])
-def start_session():
-    """Starts a new front-end session. Handles token generation or renewal.
+def renew_or_generate_jwt_token(existing_token: str=None) -> str:
+    """Renews an existing, still valid token or generates a token for a new session.
+
+    Args:
+        existing_token (str, optional): The token sent by the front-end, if any. Defaults to None.
 
     Returns:
-        Response: A Flask response containing the new token associated with the session.
+        str: The generated JWT token.
     """
-    existing_token = request.headers.get("Authorization")
-
     if existing_token:
         try:
             decoded = jwt.decode(existing_token, SECRET_KEY, algorithms=[ALGORITHM])
             session_id = decoded["session_id"]
-            return jsonify({"token": generate_jwt_token(session_id)})
+            return generate_jwt_token(session_id)
         except jwt.ExpiredSignatureError:
             pass
+    return generate_jwt_token()
 
-    token = generate_jwt_token()
-    return jsonify({"token": generate_jwt_token()})
+class ChatRequestError(Exception):
+    def __init__(self, message: str, status: int):
+        """An invalid chat request.
 
-@app.route('/chat', methods = ['POST'])
-def chatbot_endpoint():
-    """The endpoint used for generating chatbot responses to user questions.
+        Args:
+            message (str): The error message returned to the client.
+            status (int): The HTTP status code of the response.
+        """
+        super().__init__(message)
+        self.message = message
+        self.status = status
 
-    Returns:
-        Response: The Flask response containing the generated stream.
+def parse_chat_request(token: str, body: dict) -> tuple[str, str, int]:
+    """Validates a chat request and updates the last seen timestamp of its session.
 
-    Yields:
-        str: A partial response to the submitted user question.
+    Args:
+        token (str): The JWT token from the Authorization header.
+        body (dict): The JSON body of the request.
+
+    Raises:
+        ChatRequestError: If the token or a required field is missing or invalid.
+
+    Returns:
+        tuple[str, str, int]: The session ID, the prompt, and the project ID.
     """
-    token = request.headers.get("Authorization")
     if not token:
-        return jsonify({"error": "Missing token"}), 401
+        raise ChatRequestError("Missing token", 401)
     
     try:
         decoded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         session_id = decoded["session_id"]
-        sessions[session_id] = datetime.datetime.utcnow() # Update last seen timestamp.
+        session_registry.touch(session_id) # Update last seen timestamp.
     except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Session expired"}), 401
+        raise ChatRequestError("Session expired", 401)
 
-    prompt = request.json.get("prompt", "")
-    project_id = request.json.get("project_id", "")
+    prompt = body.get("prompt", "")
+    project_id = body.get("project_id", "")
 
     if not prompt and prompt.isspace():
-        return jsonify({"error": "Prompt not found in request"}), 500
+        raise ChatRequestError("Prompt not found in request", 500)
     if not project_id:
-        return jsonify({"error": "Project ID not found in request"}), 500
+        raise ChatRequestError("Project ID not found in request", 500)
+    try:
+        project_id = int(project_id) # The front-end may send the ID as a string. Normalised, so that caches key a project once.
+    except (TypeError, ValueError):
+        raise ChatRequestError("Invalid project ID", 400)
+    recent_projects.touch(project_id) # The data of recently active projects is loaded at the next startup.
+    return session_id, prompt, project_id
+
+def format_sse(data: str, event: str=None) -> str:
+    """Frames data as a Server-Sent Event. Multi-line data is split into one data field per line.
+
+    Args:
+        data (str): The event data.
+        event (str, optional): The event type. Clients treat events without a type as 'message'. Defaults to None.
+
+    Returns:
+        str: The framed event.
+    """
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+def queue_full_response(error: QueueFullError) -> tuple[dict, int, dict]:
+    """Builds the rejection for a request which did not fit into the queue.
 
-    def stream_response():
-        for chunk in generate_response(prompt, session_id, project_id):
-            yield chunk
+    Args:
+        error (QueueFullError): The rejection raised by the scheduler.
+
+    Returns:
+        tuple[dict, int, dict]: The JSON payload, the status code, and the headers of the response.
+    """
+    return {"error": "The assistant is busy. Please try again shortly.", "retry_after": error.retry_after}, 503, {"Retry-After": str(error.retry_after)}
+
+def readiness_response() -> tuple[dict, int]:
+    """Builds the response of the readiness probe.
 
-    return Response(stream_response(), content_type="text/event-stream")
+    Returns:
+        tuple[dict, int]: The JSON payload with the status of each warm-up step, and 200 if ready or 503 if not.
+    """
+    is_ready = warmup.is_ready()
+    return {"ready": is_ready, "steps": warmup.status}, 200 if is_ready else 503
+
+@app.before_request
+def warm_up():
+    """Starts the warm-up on the first request when the app is served by a WSGI server, e.g. gunicorn, instead of main.py.
+    Does nothing once it has been started. Load balancers probing /readyz make that first request.
+    """
+    start_warmup()
 
+@app.route('/healthz', methods = ['GET'])
+def healthz():
+    """Liveness probe. Answers as long as the process serves requests, also while warming up.
+
+    Returns:
+        Response: A Flask response with status 200.
+    """
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods = ['GET'])
+def readyz():
+    """Readiness probe. Load balancers should only send traffic once the models, the vectorstore and the database have been warmed up.
+    The warm-up is started by main.py, or by the first request to the app, e.g. this probe.
+
+    Returns:
+        Response: A Flask response with status 200 if ready, 503 otherwise.
+    """
+    payload, status = readiness_response()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods = ['GET'])
+def metrics():
+    """Exposes the metrics of the backend for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format.
+    """
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+@app.route('/start_session', methods = ['GET'])
+def start_session():
+    """Starts a new front-end session. Handles token generation or renewal.
+
+    Returns:
+        Response: A Flask response containing the new token associated with the session.
+    """
+    existing_token = request.headers.get("Authorization")
+    return jsonify({"token": renew_or_generate_jwt_token(existing_token)})
+
+@app.route('/chat', methods = ['POST'])
+def chatbot_endpoint():
+    """The endpoint used for generating chatbot responses to user questions.
+
+    Returns:
+        Response: The Flask response containing the generated stream as Server-Sent Events.
+
+    Yields:
+        str: A partial response to the submitted user question.
+    """
+    try:
+        session_id, prompt, project_id = parse_chat_request(request.headers.get("Authorization"), request.json)
+    except ChatRequestError as e:
+        return jsonify({"error": e.message}), e.status
+
+    # The answer pipeline is imported on first use, so that the server starts accepting connections without waiting for LangChain.
+    # The warm-up imports it in the background before the backend reports ready. Imported before reserving a ticket, which a failed import would hold.
+    generate_response = lazy_import("rag.llm").generate_response
+
+    # The ticket takes a generation slot only once the answer is generated. Reserving it here rejects requests when the lane is full.
+    try:
+        ticket = scheduler.reserve("generation")
+    except QueueFullError as e:
+        payload, status, headers = queue_full_response(e)
+        return jsonify(payload), status, headers
+
+    try:
+        def stream_response():
+            for chunk in generate_response(prompt, session_id, project_id, ticket=ticket):
+                # Queue position events are sent while waiting for a free generation slot.
+                if isinstance(chunk, QueuePosition):
+                    yield format_sse(str(chunk), event="queue")
+                else:
+                    yield format_sse(chunk)
+
+        response = Response(stream_response(), content_type="text/event-stream")
+        # The ticket is released when the server closes the response, also when the client disconnects before the stream starts,
+        # in which case the generator never runs and a finally block in it would not.
+        response.call_on_close(ticket.release)
+        return response
+    except BaseException:
+        ticket.release()
+        raise
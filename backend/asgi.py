@@ -0,0 +1,108 @@
+from quart import Quart, request, jsonify, make_response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from quart_cors import cors
+
+from api import MMT_HOST, ChatRequestError, format_sse, parse_chat_request, queue_full_response, readiness_response, renew_or_generate_jwt_token
+from rag.clients import lazy_import
+from rag.scheduler import QueueFullError, QueuePosition, scheduler
+from rag.warmup import start_warmup
+
+import asyncio
+
+
+# The asynchronous counterpart of the Flask app in api.py. Open chat streams do not hold a thread each,
+# and a stream is cancelled, including the request to Ollama, when the client disconnects.
+app = Quart(__name__)
+app = cors(app, allow_origin=[f"http://{MMT_HOST}:5173", f"http://{MMT_HOST}"])
+
+
+@app.before_serving
+async def warm_up():
+    """Starts the warm-up when the app is served directly by an ASGI server instead of main.py."""
+    start_warmup()
+
+@app.route('/healthz', methods = ['GET'])
+async def healthz():
+    """Liveness probe. Answers as long as the process serves requests, also while warming up.
+
+    Returns:
+        Response: A Quart response with status 200.
+    """
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz', methods = ['GET'])
+async def readyz():
+    """Readiness probe. Load balancers should only send traffic once the models, the vectorstore and the database have been warmed up.
+
+    Returns:
+        Response: A Quart response with status 200 if ready, 503 otherwise.
+    """
+    payload, status = readiness_response()
+    return jsonify(payload), status
+
+@app.route('/metrics', methods = ['GET'])
+async def metrics():
+    """Exposes the metrics of the backend for Prometheus.
+
+    Returns:
+        Response: The metrics in the Prometheus text format.
+    """
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
+@app.route('/start_session', methods = ['GET'])
+async def start_session():
+    """Starts a new front-end session. Handles token generation or renewal.
+
+    Returns:
+        Response: A Quart response containing the new token associated with the session.
+    """
+    existing_token = request.headers.get("Authorization")
+    return jsonify({"token": renew_or_generate_jwt_token(existing_token)})
+
+@app.route('/chat', methods = ['POST'])
+async def chatbot_endpoint():
+    """The endpoint used for generating chatbot responses to user questions.
+
+    Returns:
+        Response: The Quart response containing the generated stream as Server-Sent Events.
+
+    Yields:
+        str: A partial response to the submitted user question.
+    """
+    try:
+        session_id, prompt, project_id = parse_chat_request(request.headers.get("Authorization"), await request.get_json())
+    except ChatRequestError as e:
+        return jsonify({"error": e.message}), e.status
+
+    # Imported on first use like in ~api.chatbot_endpoint. In a thread, since the first import takes seconds, or waits for the warm-up importing it.
+    agenerate_response = (await asyncio.to_thread(lazy_import, "rag.llm")).agenerate_response
+
+    try:
+        ticket = scheduler.reserve("generation") # Takes a generation slot only once the answer is generated, like in ~api.chatbot_endpoint.
+    except QueueFullError as e:
+        payload, status, headers = queue_full_response(e)
+        return jsonify(payload), status, headers
+
+    try:
+        async def stream_response():
+            try:
+                yield # Stops here when primed below.
+                async for chunk in agenerate_response(prompt, session_id, project_id, ticket=ticket):
+                    # Queue position events are sent while waiting for a free generation slot.
+                    if isinstance(chunk, QueuePosition):
+                        yield format_sse(str(chunk), event="queue")
+                    else:
+                        yield format_sse(chunk)
+            finally:
+                ticket.release()
+
+        # The stream is started up to its first yield before it is returned, so that the ticket is released when it is closed,
+        # or finalised, also when the client disconnects before it is sent. The finally block of a generator which has not started does not run.
+        stream = stream_response()
+        await anext(stream)
+        response = await make_response(stream, {"Content-Type": "text/event-stream"})
+        response.timeout = None # Generation often takes longer than the default response timeout.
+        return response
+    except BaseException:
+        ticket.release()
+        raise
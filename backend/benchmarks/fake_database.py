@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, List
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# The tables and columns of the MMT schema which the queries in database/sql use.
+schema = """
+CREATE TABLE projects (id INTEGER PRIMARY KEY, project_name TEXT NOT NULL, created_on TEXT NOT NULL, finished_date TEXT);
+CREATE TABLE members (id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, user_id INTEGER NOT NULL, target_hours REAL NOT NULL);
+CREATE TABLE workinghours (id INTEGER PRIMARY KEY, member_id INTEGER NOT NULL, duration REAL NOT NULL);
+CREATE TABLE weeklyreports (id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, week INTEGER NOT NULL, meetings INTEGER NOT NULL);
+CREATE TABLE weeklyhours (id INTEGER PRIMARY KEY, weeklyreport_id INTEGER NOT NULL, duration REAL NOT NULL);
+CREATE TABLE metrictypes (id INTEGER PRIMARY KEY, description TEXT NOT NULL);
+CREATE TABLE metrics (id INTEGER PRIMARY KEY, weeklyreport_id INTEGER NOT NULL, metrictype_id INTEGER NOT NULL, value REAL NOT NULL);
+CREATE TABLE risks (
+    id INTEGER PRIMARY KEY, project_id INTEGER NOT NULL, description TEXT NOT NULL, impact INTEGER, probability INTEGER,
+    severity INTEGER, status INTEGER, cause TEXT, mitigation TEXT, realizations TEXT, category INTEGER
+);
+CREATE INDEX members_project ON members (project_id);
+CREATE INDEX workinghours_member ON workinghours (member_id);
+CREATE INDEX weeklyreports_project ON weeklyreports (project_id);
+CREATE INDEX weeklyhours_report ON weeklyhours (weeklyreport_id);
+CREATE INDEX metrics_report ON metrics (weeklyreport_id);
+CREATE INDEX risks_project ON risks (project_id);
+"""
+
+metric_types = ("overallStatus", "statusColor", "requirementsDone", "requirementsInProgress", "testsPassed", "testsFailed", "commits", "codeReviews")
+
+# Keys are size names, values are the number of (members, weeks, working hour entries per member and week, risks).
+project_sizes = {
+    "small": (4, 6, 2, 3),
+    "medium": (6, 12, 3, 8),
+    "large": (10, 24, 4, 20),
+}
+
+
+class SQLiteDatabase:
+    def __init__(self, path: str, latency: float=0.0):
+        """Initialises a SQLite stand-in for the MMT database with the interface of ~database.database_connector.DatabaseConnector.
+
+        Every thread gets its own connection, like connections borrowed from the pool.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            latency (float, optional): Seconds added to each query to simulate the round trip to a database server. Defaults to 0.0.
+        """
+        self.path = path
+        self.latency = latency
+        self._local = threading.local()
+
+    def get_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.create_function("CURDATE", 0, lambda: date.today().isoformat())
+        return connection
+
+    def connect(self) -> None:
+        """Opens the connection of the calling thread."""
+        self.get_connection()
+
+    @contextmanager
+    def checkout(self):
+        """Context manager for the connection of the calling thread.
+
+        Yields:
+            sqlite3.Connection: The connection.
+        """
+        yield self.get_connection()
+
+    def query(self, query: str, params=None, prepared: bool=False):
+        """Executes a query written for MariaDB.
+
+        Args:
+            query (str): The SQL query as a string, with %s placeholders.
+            params (_type_, optional): The parameters to use for the query. Defaults to None.
+            prepared (bool, optional): Accepted for compatibility. SQLite caches the statements anyway. Defaults to False.
+
+        Returns:
+            _type_: The rows as dictionaries for SELECT queries, the number of affected rows otherwise. None on errors.
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+        try:
+            connection = self.get_connection()
+            cursor = connection.execute(query.replace("%s", "?"), params or ())
+            if cursor.description is None:
+                connection.commit()
+                return cursor.rowcount
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error("Error executing query", extra={"error": str(e)})
+            return None
+
+    def close(self) -> None:
+        """Closes the connection of the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+def create_database(path: str, sizes: List[str], seed: int=0) -> Dict[int, str]:
+    """Creates the MMT schema and fills it with synthetic projects.
+
+    Args:
+        path (str): Path to the SQLite database file. Must not exist yet.
+        sizes (List[str]): Size of each project, one of the keys of project_sizes.
+        seed (int, optional): Seed of the random values. Defaults to 0.
+
+    Returns:
+        Dict[int, str]: The sizes of the created projects by project ID.
+    """
+    generator = random.Random(seed)
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.executescript(schema)
+        connection.executemany("INSERT INTO metrictypes (id, description) VALUES (?, ?)", enumerate(metric_types, start=1))
+        projects = {}
+        for project_id, size in enumerate(sizes, start=1):
+            insert_project(connection, generator, project_id, size)
+            projects[project_id] = size
+    connection.close()
+    return projects
+
+def insert_project(connection: sqlite3.Connection, generator: random.Random, project_id: int, size: str) -> None:
+    """Inserts one synthetic project with its members, working hours, weekly reports, metrics, and risks.
+
+    Args:
+        connection (sqlite3.Connection): The connection to insert with.
+        generator (random.Random): Source of the random values.
+        project_id (int): ID of the project.
+        size (str): Size of the project, one of the keys of project_sizes.
+    """
+    member_count, week_count, entries_per_week, risk_count = project_sizes[size]
+    created_on = date.today() - timedelta(weeks=week_count)
+    connection.execute("INSERT INTO projects (id, project_name, created_on, finished_date) VALUES (?, ?, ?, NULL)",
+                       (project_id, f"Project {project_id} ({size})", created_on.isoformat()))
+    for member in range(member_count):
+        member_id = connection.execute("INSERT INTO members (project_id, user_id, target_hours) VALUES (?, ?, ?)",
+                                       (project_id, project_id * 100 + member, generator.choice((100, 125, 150)))).lastrowid
+        connection.executemany("INSERT INTO workinghours (member_id, duration) VALUES (?, ?)",
+                               [(member_id, round(generator.uniform(0.5, 2.5), 1)) for _ in range(week_count * entries_per_week)])
+    for week in range(1, week_count + 1):
+        report_id = connection.execute("INSERT INTO weeklyreports (project_id, week, meetings) VALUES (?, ?, ?)",
+                                       (project_id, week, generator.randint(1, 4))).lastrowid
+        connection.executemany("INSERT INTO weeklyhours (weeklyreport_id, duration) VALUES (?, ?)",
+                               [(report_id, round(generator.uniform(2, 12), 1)) for _ in range(member_count)])
+        connection.executemany("INSERT INTO metrics (weeklyreport_id, metrictype_id, value) VALUES (?, ?, ?)",
+                               [(report_id, type_id, generator.randint(1, 3) if type_id == 1 else generator.randint(0, 40))
+                                for type_id in range(1, len(metric_types) + 1)])
+    connection.executemany("""INSERT INTO risks (project_id, description, impact, probability, severity, status, cause, mitigation, realizations, category)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", [(
+            project_id, f"Risk {risk + 1} of project {project_id}", generator.randint(0, 3), generator.randint(1, 5),
+            generator.randint(1, 5), generator.randint(0, 2), "Synthetic cause", "Synthetic mitigation", "", generator.randint(0, 6),
+        ) for risk in range(risk_count)])
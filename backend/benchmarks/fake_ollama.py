@@ -0,0 +1,295 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+
+
+# Words the fake answers are made of. Every word is one token.
+answer_words = ("the", "project", "team", "should", "review", "its", "weekly", "hours", "and", "risks", "before", "the", "next", "sprint")
+
+# Keywords deciding the route of a question, checked in this order.
+route_keywords = (
+    ("project_database", ("our", "we", "team", "risk", "metric")),
+    ("vector_database", ("course", "deadline", "due", "report", "grade", "guideline", "presentation", "sprint")),
+)
+
+# Keywords deciding which project data tools are called.
+tool_keywords = {
+    "project_working_hours": ("hours", "target", "track"),
+    "member_working_hours": ("anyone", "member", "behind"),
+    "weekly_metrics": ("metric", "week", "changed"),
+    "project_risks": ("risk",),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens in a text like ~rag.tokens.count_tokens.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return math.ceil(len(text) / 4)
+
+def embed_text(text: str, dimensions: int) -> List[float]:
+    """Embeds a text as a normalised bag of hashed words, so that texts sharing words are similar.
+
+    Args:
+        text (str): The text.
+        dimensions (int): Length of the embedding.
+
+    Returns:
+        List[float]: The embedding.
+    """
+    vector = [0.0] * dimensions
+    vector[0] = 0.1 # Keeps the embeddings of texts without words non-zero.
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode()).digest()
+        vector[1 + digest[0] % (dimensions - 1)] += 1.0 if digest[1] % 2 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+def choose_route(question: str) -> str:
+    """Chooses the route of a question by keywords, like the LLM router would.
+
+    Args:
+        question (str): The question.
+
+    Returns:
+        str: 'vector_database', 'project_database', or 'general_knowledge'.
+    """
+    words = set(re.findall(r"\w+", question.lower()))
+    for route, keywords in route_keywords:
+        if any(word.startswith(keyword) for word in words for keyword in keywords):
+            return route
+    return "general_knowledge"
+
+def choose_tools(question: str) -> List[str]:
+    """Chooses the project data tools to call for a question by keywords.
+
+    Args:
+        question (str): The question.
+
+    Returns:
+        List[str]: Names of the tools. Project info and working hours if no keyword matches.
+    """
+    text = question.lower()
+    tools = [name for name, keywords in tool_keywords.items() if any(keyword in text for keyword in keywords)]
+    return tools or ["project_info", "project_working_hours"]
+
+
+class FakeOllama:
+    def __init__(self, latency: float=0.05, prefill_rate: float=500, token_rate: float=20, answer_tokens: int=60,
+                 embedding_latency: float=0.01, dimensions: int=256, parallel: int=1, prefix_cache: bool=True):
+        """Initialises the behaviour of a fake Ollama server which answers like a chat and an embedding model.
+
+        Args:
+            latency (float, optional): Seconds before processing the prompt of each request. Defaults to 0.05.
+            prefill_rate (float, optional): Prompt tokens processed per second. 0 makes prompt processing instant. Defaults to 500.
+            token_rate (float, optional): Generated tokens per second. 0 makes generation instant. Defaults to 20.
+            answer_tokens (int, optional): Number of tokens in each free-text answer. Defaults to 60.
+            embedding_latency (float, optional): Seconds spent on each embedding request. Defaults to 0.01.
+            dimensions (int, optional): Length of the embeddings. Defaults to 256.
+            parallel (int, optional): Number of requests processed at the same time, like OLLAMA_NUM_PARALLEL. Defaults to 1.
+            prefix_cache (bool, optional): Whether a prompt starting like a recent prompt skips processing the shared prefix,
+                like the KV cache of each Ollama slot. Defaults to True.
+        """
+        self.latency = latency
+        self.prefill_rate = prefill_rate
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.embedding_latency = embedding_latency
+        self.dimensions = dimensions
+        self.chat_slots = threading.Semaphore(parallel)
+        self.embedding_slots = threading.Semaphore(parallel)
+        self.parallel = parallel
+        self.prefix_cache = prefix_cache
+        self.cached_prompts = [] # The latest prompt of each slot, from the least to the most recently used.
+        self.cache_lock = threading.Lock()
+
+    def prefill(self, prompt: str) -> int:
+        """Waits for the time processing a prompt would take. The prefix shared with the closest cached prompt is not processed.
+
+        Args:
+            prompt (str): The whole prompt.
+
+        Returns:
+            int: The number of processed prompt tokens.
+        """
+        reused = 0
+        if self.prefix_cache:
+            with self.cache_lock:
+                closest = max(self.cached_prompts, key=lambda cached: len(os.path.commonprefix((cached, prompt))), default="")
+                reused = len(os.path.commonprefix((closest, prompt)))
+                if closest and reused == len(closest):
+                    self.cached_prompts.remove(closest) # A continuation reuses the slot. Otherwise the prefix is copied into the least recently used slot.
+                self.cached_prompts.append(prompt)
+                del self.cached_prompts[:-self.parallel]
+        tokens = estimate_tokens(prompt[reused:])
+        time.sleep(self.latency + (tokens / self.prefill_rate if self.prefill_rate > 0 else 0))
+        return tokens
+
+    def decode(self, pieces: List[str]):
+        """Yields pieces of output at the generation speed.
+
+        Args:
+            pieces (List[str]): The output, one token per piece.
+
+        Yields:
+            str: The next piece.
+        """
+        for piece in pieces:
+            if self.token_rate > 0:
+                time.sleep(1 / self.token_rate)
+            yield piece
+
+    def chat(self, body: dict):
+        """Answers a chat request.
+
+        Args:
+            body (dict): The request body of /api/chat.
+
+        Yields:
+            dict: The message of each streamed chunk. The last one has the token counts and 'done' set.
+        """
+        messages = body.get("messages", [])
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        question = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        with self.chat_slots:
+            prompt_tokens = self.prefill(prompt)
+            if body.get("tools"):
+                available = {tool["function"]["name"] for tool in body["tools"]}
+                calls = [{"function": {"name": name, "arguments": {}}} for name in choose_tools(question) if name in available]
+                list(self.decode(["call"] * 8 * len(calls)))
+                yield {"message": {"role": "assistant", "content": "", "tool_calls": calls}}
+                pieces = []
+            elif body.get("format") == "json":
+                # Answers the router and the graders in one object. Batched grading numbers the documents.
+                documents = len(re.findall(r"^\[\d+\] ", prompt, re.MULTILINE))
+                answer = json.dumps({"datasource": choose_route(question), "score": "yes", "scores": ["yes"] * documents})
+                pieces = [answer[i:i+4] for i in range(0, len(answer), 4)]
+            else:
+                pieces = [f"{answer_words[i % len(answer_words)]} " for i in range(self.answer_tokens)]
+            for piece in self.decode(pieces):
+                yield {"message": {"role": "assistant", "content": piece}}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop", "prompt_eval_count": prompt_tokens, "eval_count": len(pieces)}
+
+    def embed(self, body: dict) -> dict:
+        """Answers an embedding request.
+
+        Args:
+            body (dict): The request body of /api/embed.
+
+        Returns:
+            dict: The response body.
+        """
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        with self.embedding_slots:
+            time.sleep(self.embedding_latency)
+        return {"model": body.get("model"), "embeddings": [embed_text(text, self.dimensions) for text in texts]}
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Serves the Ollama API endpoints used by the backend from the FakeOllama of the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass # Request logs would slow down the server and clutter the benchmark output.
+
+    def send_json(self, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/version":
+            self.send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self.send_json({"models": []})
+        else:
+            self.send_json({"status": "Ollama is running"})
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        fake = self.server.fake
+        if self.path == "/api/embed":
+            self.send_json(fake.embed(body))
+            return
+        if self.path != "/api/chat":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        chunks = ({"model": body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "done": False, **chunk} for chunk in fake.chat(body))
+        if not body.get("stream", True):
+            *messages, final = chunks
+            final["message"]["content"] = "".join(chunk["message"]["content"] for chunk in messages)
+            final["message"]["tool_calls"] = [call for chunk in messages for call in chunk["message"].get("tool_calls", [])]
+            self.send_json(final)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            line = (json.dumps(chunk) + "\n").encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def create_server(fake: FakeOllama, host: str="127.0.0.1", port: int=0) -> ThreadingHTTPServer:
+    """Creates a fake Ollama server. Serve it with serve_forever().
+
+    Args:
+        fake (FakeOllama): The behaviour of the server.
+        host (str, optional): Address to listen on. Defaults to "127.0.0.1".
+        port (int, optional): Port to listen on. A free port is chosen if 0. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: The server. The chosen port is in server_address.
+    """
+    server = ThreadingHTTPServer((host, port), FakeOllamaHandler)
+    server.daemon_threads = True
+    server.fake = fake
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a fake Ollama server with configurable latency and token rate.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before processing the prompt of each request.")
+    parser.add_argument("--prefill-rate", type=float, default=500, help="Prompt tokens processed per second, 0 for instant.")
+    parser.add_argument("--token-rate", type=float, default=20, help="Generated tokens per second, 0 for instant.")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens in each free-text answer.")
+    parser.add_argument("--embedding-latency", type=float, default=0.01, help="Seconds spent on each embedding request.")
+    parser.add_argument("--parallel", type=int, default=1, help="Requests processed at the same time, like OLLAMA_NUM_PARALLEL.")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="Process every prompt in full.")
+    args = parser.parse_args()
+    fake = FakeOllama(
+        latency=args.latency,
+        prefill_rate=args.prefill_rate,
+        token_rate=args.token_rate,
+        answer_tokens=args.answer_tokens,
+        embedding_latency=args.embedding_latency,
+        parallel=args.parallel,
+        prefix_cache=not args.no_prefix_cache,
+    )
+    server = create_server(fake, args.host, args.port)
+    print(f"Fake Ollama listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
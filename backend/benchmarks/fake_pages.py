@@ -0,0 +1,92 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import hashlib
+import random
+
+
+# Words the synthetic course pages are made of.
+page_words = (
+    "course", "project", "sprint", "deadline", "report", "weekly", "meeting", "requirements", "testing", "review",
+    "presentation", "grading", "team", "customer", "backlog", "demo", "retrospective", "hours", "submission", "guidelines",
+)
+
+
+def generate_page(number: int, paragraphs: int) -> bytes:
+    """Generates a synthetic course page. The same number always gives the same page.
+
+    Args:
+        number (int): Number of the page.
+        paragraphs (int): Number of paragraphs on the page.
+
+    Returns:
+        bytes: The HTML document.
+    """
+    generator = random.Random(number)
+    body = "".join(
+        f"<h2>Section {number}.{i}</h2><p>{' '.join(generator.choice(page_words) for _ in range(60))}.</p>"
+        for i in range(paragraphs)
+    )
+    return f"<html><head><title>Page {number}</title></head><body><nav>Home | Schedule</nav>{body}</body></html>".encode()
+
+
+class FakePagesHandler(BaseHTTPRequestHandler):
+    """Serves synthetic course pages at /pages/<number> with ETags, like the course pages server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        try:
+            number = int(self.path.rsplit("/", 1)[-1])
+        except ValueError:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        page = generate_page(number, self.server.paragraphs)
+        etag = f'"{hashlib.md5(page).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+
+def create_server(paragraphs: int, host: str="127.0.0.1", port: int=0) -> ThreadingHTTPServer:
+    """Creates a server of synthetic course pages. Serve it with serve_forever().
+
+    Args:
+        paragraphs (int): Number of paragraphs on each page.
+        host (str, optional): Address to listen on. Defaults to "127.0.0.1".
+        port (int, optional): Port to listen on. A free port is chosen if 0. Defaults to 0.
+
+    Returns:
+        ThreadingHTTPServer: The server. The chosen port is in server_address.
+    """
+    server = ThreadingHTTPServer((host, port), FakePagesHandler)
+    server.daemon_threads = True
+    server.paragraphs = paragraphs
+    return server
+
+def get_page_urls(server: ThreadingHTTPServer, count: int) -> List[str]:
+    """Gets the URLs of the first pages of a server.
+
+    Args:
+        server (ThreadingHTTPServer): The server created with ~benchmarks.fake_pages.create_server.
+        count (int): Number of pages.
+
+    Returns:
+        List[str]: The URLs.
+    """
+    host, port = server.server_address[:2]
+    return [f"http://{host}:{port}/pages/{number}" for number in range(count)]
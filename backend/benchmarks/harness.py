@@ -0,0 +1,249 @@
+from prometheus_client import REGISTRY
+from typing import Dict, List
+
+import json
+import logging
+import math
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Computes a percentile of values by the nearest rank.
+
+    Args:
+        values (List[float]): The values. Need not be sorted.
+        q (float): The percentile between 0 and 100.
+
+    Returns:
+        float: The percentile. NaN if there are no values.
+    """
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def peak_rss_mb() -> float:
+    """Gets the peak resident set size of the process.
+
+    Returns:
+        float: The peak RSS in megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # Bytes on macOS, kilobytes on Linux.
+
+
+class Recorder:
+    def __init__(self):
+        """Initialises a thread-safe collection of latency measurements grouped by name."""
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.windows: Dict[str, List[float]] = {} # The start of the first and the end of the last measurement by name.
+        self._lock = threading.Lock()
+
+    def record(self, name: str, latency: float) -> None:
+        """Records a successful measurement.
+
+        Args:
+            name (str): Name of the measured operation.
+            latency (float): Seconds the operation took.
+        """
+        end_time = time.perf_counter()
+        with self._lock:
+            self.latencies.setdefault(name, []).append(latency)
+            window = self.windows.setdefault(name, [end_time - latency, end_time])
+            window[0] = min(window[0], end_time - latency)
+            window[1] = max(window[1], end_time)
+
+    def record_error(self, name: str) -> None:
+        """Records a failed operation.
+
+        Args:
+            name (str): Name of the measured operation.
+        """
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summarise(self) -> Dict[str, dict]:
+        """Summarises the measurements.
+
+        Returns:
+            Dict[str, dict]: Count, errors, p50/p95/p99 and mean latency in seconds, and throughput per second by name.
+                Throughput is measured over the time between the start of the first and the end of the last operation.
+        """
+        summary = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = self.latencies.get(name, [])
+            start_time, end_time = self.windows.get(name, (0, 0))
+            summary[name] = {
+                "count": len(latencies),
+                "errors": self.errors.get(name, 0),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "mean": sum(latencies) / len(latencies) if latencies else math.nan,
+                "throughput": len(latencies) / (end_time - start_time) if end_time > start_time else math.nan,
+            }
+        return summary
+
+
+def get_stage_durations() -> Dict[str, dict]:
+    """Reads the pipeline stage timings recorded by ~rag.telemetry.span in this process.
+
+    Returns:
+        Dict[str, dict]: Count and mean seconds by stage.
+    """
+    stages = {}
+    for metric in REGISTRY.collect():
+        if metric.name != "rag_stage_duration_seconds":
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith("_count") or sample.name.endswith("_sum"):
+                stage = stages.setdefault(sample.labels["stage"], {})
+                stage["count" if sample.name.endswith("_count") else "sum"] = sample.value
+    return {stage: {"count": int(values["count"]), "mean": values["sum"] / values["count"]} for stage, values in sorted(stages.items()) if values.get("count")}
+
+def get_prefix_hit_ratio() -> float:
+    """Reads the share of prompts whose per-project prefix was a hit, recorded by ~rag.prompt_prefix in this process.
+
+    Returns:
+        float: The hit ratio. None if no prompt had a per-project prefix.
+    """
+    hits = REGISTRY.get_sample_value("rag_prompt_prefix_requests_total", {"result": "hit"}) or 0
+    misses = REGISTRY.get_sample_value("rag_prompt_prefix_requests_total", {"result": "miss"}) or 0
+    return hits / (hits + misses) if hits + misses else None
+
+def start_fake_ollama(options: List[str]) -> tuple:
+    """Starts the fake Ollama server in a subprocess, so that it does not compete with the benchmark for the GIL.
+
+    Args:
+        options (List[str]): Command line options of ~benchmarks.fake_ollama.
+
+    Returns:
+        tuple: The process and the base URL of the server.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_ollama", "--port", "0", *options],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("The fake Ollama server did not start.")
+    return process, line.rsplit(" ", 1)[-1].strip()
+
+def configure_environment(workdir: str, ollama_url: str, fake_models: bool) -> None:
+    """Points the backend at the benchmark services and a scratch directory. Must be called before importing the rag modules.
+
+    Args:
+        workdir (str): Directory for the vectorstore and the other files written by the backend.
+        ollama_url (str): Base URL of the Ollama server.
+        fake_models (bool): Whether the server is the fake one. Model names are taken from .env otherwise.
+    """
+    os.environ["OLLAMA_HOST"] = ollama_url
+    if fake_models:
+        os.environ.setdefault("MODEL_NAME", "benchmark-chat")
+        os.environ.setdefault("EMBEDDING_MODEL_NAME", "benchmark-embedding")
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "chroma_db")
+    os.environ["INGESTION_MANIFEST_PATH"] = os.path.join(workdir, "manifest.json")
+    os.environ["HISTORY_DB_PATH"] = os.path.join(workdir, "chat_history.db")
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["INGESTION_REFRESH_INTERVAL"] = "0"
+
+def print_report(scenario: str, summary: Dict[str, dict], stages: Dict[str, dict], elapsed: float, rss: float, prefix_hit_ratio: float=None) -> None:
+    """Prints the results of a scenario as a table.
+
+    Args:
+        scenario (str): Name of the scenario.
+        summary (Dict[str, dict]): The summary of ~benchmarks.harness.Recorder.summarise.
+        stages (Dict[str, dict]): The stage timings of ~benchmarks.harness.get_stage_durations.
+        elapsed (float): Wall clock seconds of the scenario.
+        rss (float): Peak RSS in megabytes.
+        prefix_hit_ratio (float, optional): The project prompt prefix hit ratio. Not printed if None. Defaults to None.
+    """
+    print(f"\nScenario {scenario}: {elapsed:.2f} s, peak RSS {rss:.0f} MB")
+    if prefix_hit_ratio is not None:
+        print(f"Project prompt prefix hit ratio {prefix_hit_ratio:.2f}")
+    print(f"{'operation':<32} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per s':>8}")
+    for name, values in summary.items():
+        print(f"{name:<32} {values['count']:>6} {values['errors']:>6} {values['p50'] * 1000:>9.1f} {values['p95'] * 1000:>9.1f} "
+              f"{values['p99'] * 1000:>9.1f} {values['throughput']:>8.2f}")
+    if stages:
+        print(f"\n{'stage':<32} {'count':>6} {'mean ms':>9}")
+        for stage, values in stages.items():
+            print(f"{stage:<32} {values['count']:>6} {values['mean'] * 1000:>9.1f}")
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Finds operations whose p95 latency has grown beyond the tolerance since a baseline run.
+
+    Args:
+        results (dict): The results of this run, as written with --output.
+        baseline (dict): The results of the baseline run.
+        tolerance (float): Allowed relative growth, e.g. 0.2 for 20 %.
+
+    Returns:
+        List[str]: Descriptions of the regressions. Empty if there are none.
+    """
+    regressions = []
+    for name, values in results["operations"].items():
+        previous = baseline.get("operations", {}).get(name)
+        if previous is None or not previous["count"] or not values["count"]:
+            continue
+        if values["p95"] > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95'] * 1000:.1f} ms -> {values['p95'] * 1000:.1f} ms")
+    if results["peak_rss_mb"] > baseline.get("peak_rss_mb", math.inf) * (1 + tolerance):
+        regressions.append(f"peak RSS: {baseline['peak_rss_mb']:.0f} MB -> {results['peak_rss_mb']:.0f} MB")
+    return regressions
+
+def save_results(path: str, results: dict) -> None:
+    """Saves the results of a run as JSON, for use as a baseline.
+
+    Args:
+        path (str): Path to the file.
+        results (dict): The results.
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+def load_results(path: str) -> dict:
+    """Loads the results of an earlier run.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        dict: The results.
+    """
+    with open(path, "r") as f:
+        return json.load(f)
+
+def timed(recorder: Recorder, name: str, function, *args, **kwargs):
+    """Calls a function and records its latency, or an error if it raises.
+
+    Args:
+        recorder (Recorder): Where to record.
+        name (str): Name of the measured operation.
+        function (Callable): The function.
+        *args: Arguments of the function.
+        **kwargs: Keyword arguments of the function.
+
+    Returns:
+        _type_: The return value of the function. None if it raised.
+    """
+    start_time = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except Exception as e:
+        recorder.record_error(name)
+        logger.error("Benchmark operation failed", extra={"operation": name, "error": str(e)})
+        return None
+    recorder.record(name, time.perf_counter() - start_time)
+    return result
@@ -0,0 +1,86 @@
+from typing import Dict, List
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# Modules which start the backend or are used by maintenance tasks, and must import quickly.
+entry_modules = ("api", "asgi", "main", "rag.warmup", "rag.document_manager", "database.sql_executor")
+
+# Packages which are imported on first use only. Loading any of them when importing an entry module fails the check.
+heavy_packages = ("langchain", "langchain_core", "langchain_community", "langchain_ollama", "langchain_text_splitters", "ollama", "chromadb", "bs4", "mysql")
+
+# Imports a module in a fresh interpreter, and prints the import time and the heavy packages loaded as JSON.
+measure_code = """
+import importlib, json, sys, time
+start_time = time.perf_counter()
+importlib.import_module(sys.argv[1])
+elapsed = time.perf_counter() - start_time
+heavy = sorted({name.split(".")[0] for name in sys.modules} & set(sys.argv[2].split(",")))
+print(json.dumps({"elapsed": elapsed, "heavy": heavy}))
+"""
+
+
+def measure_import(module: str, repeat: int) -> dict:
+    """Measures the import time of a module, each time in a new process so that nothing is imported already.
+
+    Args:
+        module (str): Name of the module.
+        repeat (int): Number of measurements. The fastest is kept, since slower ones are slowed down by the machine.
+
+    Returns:
+        dict: The fastest import time in seconds and the heavy packages loaded.
+    """
+    # Placeholders for the variables required at import, unless set. Nothing connects anywhere at import.
+    env = {"MODEL_NAME": "unused", "EMBEDDING_MODEL_NAME": "unused", "JWT_ALGORITHM": "HS256", "JWT_SECRET_KEY": "unused", **os.environ}
+    measurements = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", measure_code, module, ",".join(heavy_packages)],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        measurements.append(json.loads(output.strip().splitlines()[-1]))
+    return min(measurements, key=lambda measurement: measurement["elapsed"])
+
+def check_budget(results: Dict[str, dict], budget: float) -> List[str]:
+    """Finds modules which import too slowly or load heavy packages.
+
+    Args:
+        results (Dict[str, dict]): Keys are module names, values are the measurements of ~benchmarks.import_time.measure_import.
+        budget (float): Allowed import time in seconds.
+
+    Returns:
+        List[str]: Descriptions of the violations. Empty if every module is within the budget.
+    """
+    violations = []
+    for module, result in results.items():
+        if result["elapsed"] > budget:
+            violations.append(f"{module}: {result['elapsed'] * 1000:.0f} ms exceeds the budget of {budget * 1000:.0f} ms")
+        if result["heavy"]:
+            violations.append(f"{module}: imports {', '.join(result['heavy'])} eagerly")
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that the entry modules of the backend import within a time budget, without the heavy dependencies.")
+    parser.add_argument("modules", nargs="*", default=entry_modules, help="Modules to check. Defaults to the entry modules.")
+    parser.add_argument("--budget", type=float, default=0.75, help="Allowed import time of each module in seconds.")
+    parser.add_argument("--repeat", type=int, default=3, help="Measurements of each module. The fastest is kept.")
+    args = parser.parse_args()
+
+    results = {module: measure_import(module, args.repeat) for module in args.modules}
+    print(f"{'module':<32} {'import ms':>9}  heavy packages")
+    for module, result in results.items():
+        print(f"{module:<32} {result['elapsed'] * 1000:>9.1f}  {', '.join(result['heavy']) or '-'}")
+    violations = check_budget(results, args.budget)
+    for violation in violations:
+        print(f"Over budget: {violation}")
+    if violations:
+        sys.exit(1)
@@ -0,0 +1,120 @@
+from typing import Dict
+
+from benchmarks.harness import compare_to_baseline, configure_environment, get_prefix_hit_ratio, get_stage_durations, load_results, peak_rss_mb, print_report, save_results, start_fake_ollama
+
+import argparse
+import sys
+import tempfile
+import time
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """Parses a route mix such as 'vector_database=0.4,project_database=0.4,general_knowledge=0.2'.
+
+    Args:
+        text (str): The mix.
+
+    Returns:
+        Dict[str, float]: The weights by route.
+    """
+    return {route: float(weight) for route, weight in (part.split("=") for part in text.split(","))}
+
+def parse_sizes(text: str) -> list:
+    """Parses project counts by size such as 'small=4,medium=3,large=1' into a list of project sizes.
+
+    Args:
+        text (str): The counts.
+
+    Returns:
+        list: The size of each project.
+    """
+    return [size for size, count in (part.split("=") for part in text.split(",")) for _ in range(int(count))]
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the backend against a fake Ollama server and a SQLite stand-in for the MMT database.")
+    parser.add_argument("scenario", choices=("chat", "project_data", "ingestion"))
+    parser.add_argument("--output", help="Write the results as JSON into this file.")
+    parser.add_argument("--baseline", help="Compare against results written earlier with --output. Exits with 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative growth of p95 latency and peak RSS over the baseline.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+
+    fake = parser.add_argument_group("fake Ollama")
+    fake.add_argument("--ollama-url", help="Use this Ollama server instead of starting the fake one.")
+    fake.add_argument("--latency", default="0.05", help="Seconds before processing the prompt of each request.")
+    fake.add_argument("--prefill-rate", default="500", help="Prompt tokens processed per second, 0 for instant.")
+    fake.add_argument("--token-rate", default="20", help="Generated tokens per second, 0 for instant.")
+    fake.add_argument("--answer-tokens", default="60", help="Tokens in each free-text answer.")
+    fake.add_argument("--embedding-latency", default="0.01", help="Seconds spent on each embedding request.")
+    fake.add_argument("--parallel", default="1", help="Requests the fake server processes at the same time.")
+    fake.add_argument("--no-prefix-cache", action="store_true", help="Make the fake server process every prompt in full.")
+
+    workload = parser.add_argument_group("workload")
+    workload.add_argument("--sessions", type=int, default=8, help="Concurrent chat sessions.")
+    workload.add_argument("--questions", type=int, default=5, help="Questions asked in each chat session.")
+    workload.add_argument("--mix", type=parse_mix, default="vector_database=0.4,project_database=0.4,general_knowledge=0.2",
+                          help="Relative weight of each route in the chat questions.")
+    workload.add_argument("--projects", type=parse_sizes, default="small=4,medium=3,large=1", help="Number of synthetic projects of each size.")
+    workload.add_argument("--db-latency", type=float, default=0.002, help="Seconds added to each database query.")
+    workload.add_argument("--requests", type=int, default=200, help="Project data requests.")
+    workload.add_argument("--workers", type=int, help="Concurrent project data requests (default 8), or pages indexed at the same time (default FETCH_CONCURRENCY).")
+    workload.add_argument("--cold", action="store_true", help="Drop cached project data before each request.")
+    workload.add_argument("--pages", type=int, default=20, help="Course pages to index.")
+    workload.add_argument("--paragraphs", type=int, default=20, help="Paragraphs on each course page.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    fake_process = None
+    ollama_url = args.ollama_url
+    if ollama_url is None:
+        fake_process, ollama_url = start_fake_ollama([
+            "--latency", args.latency,
+            "--prefill-rate", args.prefill_rate,
+            "--token-rate", args.token_rate,
+            "--answer-tokens", args.answer_tokens,
+            "--embedding-latency", args.embedding_latency,
+            "--parallel", args.parallel,
+            *(["--no-prefix-cache"] if args.no_prefix_cache else []),
+        ])
+    workdir = tempfile.TemporaryDirectory(prefix="mmt_benchmark_")
+    configure_environment(workdir.name, ollama_url, fake_models=fake_process is not None)
+
+    # The backend is imported only now, so that it picks up the environment set above.
+    from benchmarks import scenarios
+    from rag.telemetry import configure_logging
+    configure_logging(level=args.log_level, format="text")
+
+    start_time = time.perf_counter()
+    try:
+        if args.scenario == "chat":
+            recorder = scenarios.run_chat(workdir.name, args.sessions, args.questions, args.mix, args.projects, args.pages,
+                                          args.paragraphs, args.db_latency, args.seed)
+        elif args.scenario == "project_data":
+            recorder = scenarios.run_project_data(workdir.name, args.projects, args.workers or 8, args.requests, args.cold, args.db_latency, args.seed)
+        else:
+            recorder = scenarios.run_ingestion(args.pages, args.paragraphs, args.workers or scenarios.document_manager.fetch_concurrency)
+    finally:
+        if fake_process is not None:
+            fake_process.terminate()
+    elapsed = time.perf_counter() - start_time
+
+    results = {
+        "scenario": args.scenario,
+        "arguments": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "elapsed": elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "operations": recorder.summarise(),
+        "stages": get_stage_durations(),
+        "prefix_hit_ratio": get_prefix_hit_ratio(),
+    }
+    print_report(args.scenario, results["operations"], results["stages"], elapsed, results["peak_rss_mb"], results["prefix_hit_ratio"])
+    if args.output:
+        save_results(args.output, results)
+    if args.baseline:
+        regressions = compare_to_baseline(results, load_results(args.baseline), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
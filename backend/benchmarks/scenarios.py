@@ -0,0 +1,205 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmarks.fake_database import SQLiteDatabase, create_database
+from benchmarks.fake_pages import create_server, get_page_urls
+from benchmarks.harness import Recorder, timed
+from database import sql_executor
+from rag import document_manager
+from rag.llm import generate_response
+from rag.scheduler import QueuePosition, scheduler
+
+import logging
+import os
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Questions for each route. Worded differently from the router examples, so that the local router is exercised realistically.
+questions_by_route = {
+    "vector_database": (
+        "When is the deadline of the final report on the course?",
+        "What must the weekly report of the course include?",
+        "How is the course presentation graded?",
+        "Where can the course guidelines be found?",
+        "When are the sprint reviews of the course held?",
+    ),
+    "project_database": (
+        "How do our working hours compare to the target?",
+        "Which of our team members are behind on hours?",
+        "What are the biggest risks of our project right now?",
+        "How have our metrics changed in the last weeks?",
+        "Is our team on track?",
+    ),
+    "general_knowledge": (
+        "What is a user story?",
+        "How should good unit tests be written?",
+        "Explain continuous integration briefly.",
+        "What is technical debt?",
+        "How does pair programming work?",
+    ),
+}
+
+
+def setup_database(workdir: str, sizes: List[str], latency: float) -> Dict[int, str]:
+    """Creates the fake MMT database and makes the project data queries use it.
+
+    Args:
+        workdir (str): Directory for the database file.
+        sizes (List[str]): Size of each synthetic project.
+        latency (float): Seconds added to each query.
+
+    Returns:
+        Dict[int, str]: The sizes of the projects by project ID.
+    """
+    path = os.path.join(workdir, "mmt.db")
+    projects = create_database(path, sizes)
+    sql_executor.db = SQLiteDatabase(path, latency)
+    return projects
+
+def start_pages(paragraphs: int):
+    """Starts serving synthetic course pages in a background thread.
+
+    Args:
+        paragraphs (int): Number of paragraphs on each page.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = create_server(paragraphs)
+    threading.Thread(target=server.serve_forever, name="fake_pages", daemon=True).start()
+    return server
+
+def ingest_pages(urls: List[str], workers: int, recorder: Recorder, name: str) -> None:
+    """Indexes pages concurrently like ~rag.document_manager.add_documents_from_urls, timing each page.
+
+    Args:
+        urls (List[str]): URLs of the pages.
+        workers (int): Number of pages indexed at the same time.
+        recorder (Recorder): Where to record the latencies.
+        name (str): Name of the measured operation.
+    """
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="benchmark_ingestion") as executor:
+        list(executor.map(lambda url: timed(recorder, name, document_manager.index_url, url), urls))
+
+def ask(recorder: Recorder, question: str, session_id: str, project_id: int, route: str) -> None:
+    """Asks one question like the /chat endpoint does, recording its total latency and time to first token.
+
+    Args:
+        recorder (Recorder): Where to record the latencies.
+        question (str): The question.
+        session_id (str): ID of the session.
+        project_id (int): ID of the project of the session.
+        route (str): The route the question was drawn for. Used in the operation names.
+    """
+    start_time = time.perf_counter()
+    first_token_time = None
+    try:
+        ticket = scheduler.reserve("generation")
+        try:
+            for piece in generate_response(question, session_id, project_id, ticket=ticket):
+                if first_token_time is None and piece and not isinstance(piece, QueuePosition):
+                    first_token_time = time.perf_counter()
+        finally:
+            ticket.release()
+    except Exception as e:
+        recorder.record_error("chat")
+        recorder.record_error(f"chat/{route}")
+        logger.error("Benchmark question failed", extra={"route": route, "error": str(e)})
+        return
+    latency = time.perf_counter() - start_time
+    recorder.record("chat", latency)
+    recorder.record(f"chat/{route}", latency)
+    if first_token_time is not None:
+        recorder.record("chat/first_token", first_token_time - start_time)
+
+def run_chat(workdir: str, sessions: int, questions: int, mix: Dict[str, float], sizes: List[str], pages: int,
+             paragraphs: int, db_latency: float, seed: int) -> Recorder:
+    """Runs concurrent chat sessions asking questions of mixed routes, one question at a time per session.
+
+    Args:
+        workdir (str): Scratch directory.
+        sessions (int): Number of concurrent sessions.
+        questions (int): Number of questions asked in each session.
+        mix (Dict[str, float]): Relative weight of each route in the drawn questions.
+        sizes (List[str]): Size of each synthetic project. Sessions are spread over the projects.
+        pages (int): Number of course pages indexed before the sessions start.
+        paragraphs (int): Number of paragraphs on each page.
+        db_latency (float): Seconds added to each database query.
+        seed (int): Seed of the drawn questions.
+
+    Returns:
+        Recorder: The measurements.
+    """
+    projects = setup_database(workdir, sizes, db_latency)
+    server = start_pages(paragraphs)
+    ingest_pages(get_page_urls(server, pages), document_manager.fetch_concurrency, Recorder(), "setup")
+    recorder = Recorder()
+    routes, weights = zip(*mix.items())
+
+    def run_session(number: int) -> None:
+        generator = random.Random(seed + number)
+        project_id = list(projects)[number % len(projects)]
+        for _ in range(questions):
+            route = generator.choices(routes, weights)[0]
+            ask(recorder, generator.choice(questions_by_route[route]), f"benchmark-{number}", project_id, route)
+
+    threads = [threading.Thread(target=run_session, args=(number,), name=f"benchmark_session_{number}") for number in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    return recorder
+
+def run_project_data(workdir: str, sizes: List[str], workers: int, requests: int, cold: bool, db_latency: float, seed: int) -> Recorder:
+    """Loads project data concurrently with ~database.sql_executor.get_project_data.
+
+    Args:
+        workdir (str): Scratch directory.
+        sizes (List[str]): Size of each synthetic project.
+        workers (int): Number of concurrent requests.
+        requests (int): Total number of requests.
+        cold (bool): Whether to drop the cached data of the project before each request.
+        db_latency (float): Seconds added to each database query.
+        seed (int): Seed of the drawn projects.
+
+    Returns:
+        Recorder: The measurements.
+    """
+    projects = setup_database(workdir, sizes, db_latency)
+    generator = random.Random(seed)
+    drawn = [generator.choice(list(projects)) for _ in range(requests)]
+    recorder = Recorder()
+
+    def load(project_id: int) -> None:
+        if cold:
+            sql_executor.invalidate_project_data(project_id)
+        if not timed(recorder, f"project_data/{projects[project_id]}", sql_executor.get_project_data, project_id):
+            logger.warning("No project data", extra={"project_id": project_id})
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="benchmark_project_data") as executor:
+        list(executor.map(load, drawn))
+    return recorder
+
+def run_ingestion(pages: int, paragraphs: int, workers: int) -> Recorder:
+    """Indexes synthetic course pages, then indexes them again unchanged like the periodic refresh.
+
+    Args:
+        pages (int): Number of pages.
+        paragraphs (int): Number of paragraphs on each page.
+        workers (int): Number of pages indexed at the same time.
+
+    Returns:
+        Recorder: The measurements of the new and the unchanged pages.
+    """
+    server = start_pages(paragraphs)
+    urls = get_page_urls(server, pages)
+    recorder = Recorder()
+    ingest_pages(urls, workers, recorder, "ingestion/new")
+    ingest_pages(urls, workers, recorder, "ingestion/unchanged")
+    server.shutdown()
+    return recorder
@@ -1,8 +1,90 @@
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from mysql.connector import Error
+from typing import Callable
 
+import logging
 import mysql.connector
 import os
+import queue
+import threading
+import weakref
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    def __init__(self, connect: Callable, min_size: int, max_size: int, timeout: float):
+        """Initialises a pool of database connections.
+
+        Connections are created on demand up to max_size, and min_size connections are opened up front.
+        Every borrowed connection is health-checked and reconnected if the server has dropped it.
+
+        Args:
+            connect (Callable): Function returning a new database connection.
+            min_size (int): Number of connections opened when the pool is created.
+            max_size (int): Maximum number of connections open at the same time.
+            timeout (float): Seconds to wait for a free connection before giving up.
+        """
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue() # LIFO keeps the most recently used, i.e. warmest, connections in use.
+        self._slots = threading.BoundedSemaphore(max_size)
+        for _ in range(min_size):
+            self._idle.put(self.connect())
+
+    def acquire(self):
+        """Borrows a connection from the pool. Opens a new connection if none are idle.
+
+        Raises:
+            TimeoutError: If no connection is freed within the pool timeout.
+
+        Returns:
+            _type_: A connected database connection.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No free database connection within {self.timeout} seconds.")
+        try:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            try:
+                # Health check on borrow. Reconnects the same connection object if it has been dropped.
+                connection.ping(reconnect=True, attempts=2, delay=0)
+                return connection
+            except Error:
+                return self.connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection) -> None:
+        """Returns a borrowed connection into the pool.
+
+        Args:
+            connection (_type_): The connection borrowed with ~ConnectionPool.acquire.
+        """
+        try:
+            if connection is not None:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.close()
+            except Error:
+                pass
 
 
 class DatabaseConnector:
@@ -15,6 +97,10 @@ class DatabaseConnector:
         DB_USER: Database user to use the database as.
         DB_PASS: Database password for the selected user.
         DB_NAME: Name of the database schema to connect to.
+        DB_POOL_ENABLED: Whether to use a connection pool instead of a single shared connection.
+        DB_POOL_MIN_SIZE: Number of pooled connections opened on connect.
+        DB_POOL_MAX_SIZE: Maximum number of pooled connections.
+        DB_POOL_TIMEOUT: Seconds to wait for a free pooled connection.
 
         If any of the parameters are missing, it is assumed that an MMT instance started with "make run" is
         running locally and default parameters are used.
@@ -26,55 +112,131 @@ class DatabaseConnector:
         self.user = os.getenv("DB_USER", "my_app")
         self.password = os.getenv("DB_PASS", "secret")
         self.database = os.getenv("DB_NAME", "my_app")
+        self.pool_enabled = os.getenv("DB_POOL_ENABLED", "true").lower() == "true"
+        self.pool_min_size = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+        self.pool_max_size = int(os.getenv("DB_POOL_MAX_SIZE", 8))
+        self.pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", 10))
         self.connection = None
-    
+        self.pool = None
+        # Serialises use of the single shared connection when pooling is disabled.
+        self._connection_lock = threading.Lock()
+        # Keys are connections, values map SQL texts to prepared cursors. Statements are prepared once per connection.
+        self._prepared_cursors = weakref.WeakKeyDictionary()
+
+    def open_connection(self):
+        """Opens a new database connection using the parameters of the object.
+
+        Returns:
+            _type_: The new database connection.
+        """
+        return mysql.connector.connect(
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            autocommit=True, # Each SELECT sees fresh data instead of a snapshot held open by an idle transaction.
+        )
+
     def connect(self):
-        """Creates a database connection.
+        """Creates a database connection, or the connection pool if pooling is enabled.
 
         Connection parameters must be defined into the object beforehand.
         """
         try:
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                database=self.database
-            )
+            if self.pool_enabled:
+                self.pool = ConnectionPool(self.open_connection, self.pool_min_size, self.pool_max_size, self.pool_timeout)
+                logger.info("MariaDB connection pool established", extra={"min_size": self.pool_min_size, "max_size": self.pool_max_size})
+                return
+            self.connection = self.open_connection()
             if self.connection.is_connected():
-                print("MariaDB connection established.")
+                logger.info("MariaDB connection established")
         except Error as e:
-            print(f"Error establishing MariaDB connection: {e}")
+            logger.error("Error establishing MariaDB connection", extra={"error": str(e)})
             self.connection = None
+            self.pool = None
+
+    @contextmanager
+    def checkout(self):
+        """Context manager for borrowing a database connection.
+        Attempts to establish the database connection automatically if it does not exist, and reconnects dropped connections.
 
-    def query(self, query: str, params=None):
+        Yields:
+            _type_: A database connection, or None if connecting failed.
+        """
+        if self.pool is None and self.connection is None:
+            with self._connection_lock:
+                if self.pool is None and self.connection is None:
+                    self.connect()
+        if self.pool is not None:
+            try:
+                connection = self.pool.acquire()
+            except (Error, TimeoutError) as e:
+                logger.error("Error borrowing MariaDB connection", extra={"error": str(e)})
+                connection = None
+            if connection is None:
+                yield None
+                return
+            try:
+                yield connection
+            finally:
+                self.pool.release(connection)
+            return
+        with self._connection_lock:
+            try:
+                if self.connection is not None:
+                    self.connection.ping(reconnect=True, attempts=2, delay=0)
+            except Error as e:
+                logger.error("Error reconnecting to MariaDB", extra={"error": str(e)})
+                self.connection = None
+            yield self.connection
+
+    @contextmanager
+    def cursor(self, **kwargs):
+        """Context manager for a cursor on a borrowed connection. The cursor is closed and the connection returned on exit.
+
+        Args:
+            **kwargs: Arguments passed on to the cursor, e.g. dictionary=True.
+
+        Yields:
+            _type_: A tuple of the connection and the cursor, or (None, None) if connecting failed.
+        """
+        with self.checkout() as connection:
+            if connection is None:
+                yield None, None
+                return
+            cursor = connection.cursor(**kwargs)
+            try:
+                yield connection, cursor
+            finally:
+                cursor.close()
+
+    def query(self, query: str, params=None, prepared: bool=False):
         """General purpose database query function.
         Performs any database query.
         Attempts to establish the database connection automatically if it does not exist.
+        Safe to call from several threads at once.
 
         Args:
             query (str): The SQL query as a string.
             params (_type_, optional): The parameters to use for the query. Defaults to None.
+            prepared (bool, optional): Whether to execute a SELECT query as a server-side prepared statement. Defaults to False.
 
         Returns:
             _type_: A data structure containing the query results.
         """
-        if self.connection is None:
-            self.connect()
-        if not self.connection:
-            print(f"Query failed due to connection error.")
-            return None
         if "SELECT" in query:
+            if prepared:
+                return self.prepared_select_query(query, params)
             return self.select_query(query, params)
         elif any(op in query for op in ["INSERT", "UPDATE", "DELETE"]):
             return self.execute_query(query, params)
         # If both conditions above were false, the query is erroneous.
-        print(f"Erroneous query: {query}")
+        logger.error("Erroneous query", extra={"query": query})
         return None
-    
+
     def select_query(self, query: str, params=None):
         """Database query function for executing SELECT SQL queries.
-        Should not be called directly as ~llm.database_connector.DatabaseConnector.query handles the connection.
 
         Args:
             query (str): The SQL SELECT query as a string.
@@ -84,16 +246,52 @@ class DatabaseConnector:
             _type_: A data structure containing the query results
         """
         try:
-            cursor = self.connection.cursor(dictionary=True)
-            cursor.execute(query, params or ())
-            return cursor.fetchall()
+            with self.cursor(dictionary=True) as (connection, cursor):
+                if cursor is None:
+                    logger.error("Query failed due to connection error")
+                    return None
+                cursor.execute(query, params or ())
+                return cursor.fetchall()
         except Error as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query", extra={"error": str(e)})
             return None
-    
+
+    def prepared_select_query(self, query: str, params=None):
+        """Database query function for executing SELECT SQL queries as prepared statements.
+        The statement is prepared once per connection and re-executed with new parameters on later calls.
+
+        Args:
+            query (str): The SQL SELECT query as a string.
+            params (_type_, optional): The parameters to use for the query. Defaults to None.
+
+        Returns:
+            _type_: A data structure containing the query results
+        """
+        try:
+            with self.checkout() as connection:
+                if connection is None:
+                    logger.error("Query failed due to connection error")
+                    return None
+                cursors = self._prepared_cursors.setdefault(connection, {})
+                try:
+                    return self._execute_prepared(connection, cursors, query, params)
+                except Error:
+                    # The statement may have been lost in a reconnect. Prepare it again once.
+                    cursors.clear()
+                    return self._execute_prepared(connection, cursors, query, params)
+        except Error as e:
+            logger.error("Error executing query", extra={"error": str(e)})
+            return None
+
+    def _execute_prepared(self, connection, cursors: dict, query: str, params=None):
+        cursor = cursors.get(query)
+        if cursor is None:
+            cursor = cursors[query] = connection.cursor(prepared=True, dictionary=True)
+        cursor.execute(query, params or ())
+        return cursor.fetchall()
+
     def execute_query(self, query: str, params=None):
         """Database query function for executing SQL queries which have an effect on the database state.
-        Should not be called directly as ~llm.database_connector.DatabaseConnector.query handles the connection.
 
         Args:
             query (str): an SQL UPDATE, INSERT, or DELETE query as a string.
@@ -103,17 +301,23 @@ class DatabaseConnector:
             _type_: The number of rows affected.
         """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params or ())
-            self.connection.commit()
-            return cursor.rowcount
+            with self.cursor() as (connection, cursor):
+                if cursor is None:
+                    logger.error("Query failed due to connection error")
+                    return None
+                cursor.execute(query, params or ())
+                connection.commit()
+                return cursor.rowcount
         except Error as e:
-            print(f"Error executing query: {e}")
+            logger.error("Error executing query", extra={"error": str(e)})
             return None
-    
+
     def close(self):
-        """Closes the database connection."""
+        """Closes the database connection, or all pooled connections."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+            logger.info("MariaDB connection pool closed")
         if self.connection and self.connection.is_connected():
             self.connection.close()
-            print("MariaDB connection closed.")
-
+            logger.info("MariaDB connection closed")
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import threading
+import time
+
+
+class ProjectDataCache:
+    def __init__(self, ttl: float, max_size: int):
+        """Initialises a project-keyed cache with a time-to-live and a least recently used size bound.
+
+        Concurrent misses for the same key are deduplicated, so that only one caller loads the value
+        while the others wait for its result.
+
+        Args:
+            ttl (float): Seconds after which a cached entry is considered stale. 0 disables caching.
+            max_size (int): Maximum number of entries held. The least recently used entry is evicted first.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # Keys are cache keys, values are (expiry timestamp, value) -tuples.
+        self._loading = {} # Keys are cache keys, values are events set when the in-flight load finishes.
+        self._invalidated = set() # Keys invalidated while being loaded. Their loaded values are stale and not cached.
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Returns the cached value for a key. Calls the loader on a miss and caches its result.
+
+        If another thread is already loading the same key, waits for it instead of calling the loader again.
+        Results evaluating to False (e.g. failed queries) are returned but not cached.
+
+        Args:
+            key (Hashable): The cache key, e.g. a project ID.
+            loader (Callable[[], Any]): Function producing the value on a miss.
+
+        Returns:
+            Any: The cached or freshly loaded value.
+        """
+        if self.ttl <= 0:
+            return loader()
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                loading = self._loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = self._loading[key] = threading.Event()
+                    break
+            # Another thread is loading the key. Wait for it and check the cache again.
+            loading.wait()
+
+        try:
+            value = loader()
+            with self._lock:
+                if value and key not in self._invalidated:
+                    self._entries[key] = (time.monotonic() + self.ttl, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+                self._invalidated.discard(key)
+            loading.set()
+
+    def invalidate(self, key: Hashable) -> None:
+        """Removes a single entry from the cache. A load of the key in flight is not cached, since it may have read the data before the change.
+
+        Args:
+            key (Hashable): The key of the entry to remove.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            if key in self._loading:
+                self._invalidated.add(key)
+
+    def clear(self) -> None:
+        """Removes all entries from the cache. Loads in flight are not cached."""
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.update(self._loading)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -5,4 +5,5 @@ FROM projects p
   INNER JOIN members m ON m.project_id = p.id
   INNER JOIN workinghours wh ON wh.member_id = m.id
 WHERE p.id = %s
-GROUP BY m.user_id;
+GROUP BY m.user_id
+ORDER BY m.user_id;
@@ -9,4 +9,5 @@ FROM projects p
   LEFT JOIN metrics m ON m.weeklyreport_id = wr.id
   INNER JOIN metrictypes mt ON mt.id = m.metrictype_id
 WHERE p.id = %s
-GROUP BY m.id;
+GROUP BY m.id
+ORDER BY wr.week, m.id;
@@ -9,4 +9,5 @@ SELECT r.description,
   r.category
 FROM projects p
   INNER JOIN risks r ON r.project_id = p.id
-WHERE p.id = %s;
+WHERE p.id = %s
+ORDER BY r.id;
@@ -1,15 +1,51 @@
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from functools import partial
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily
+from prometheus_client.registry import Collector
+from typing import Callable, Iterator, List, Dict, Tuple
 
-from database.database_connector import DatabaseConnector
+from database.project_data_cache import ProjectDataCache
 
+import logging
 import os
+import threading
 
 
-db = DatabaseConnector()
+load_dotenv()
+logger = logging.getLogger(__name__)
+# The connector of the MMT database. Created on first use by get_database, so that importing this module does not import the MySQL driver.
+db = None
+db_lock = threading.Lock()
+
+# Project data is cached per project, so that new sessions on the same project do not re-run every query.
+project_data_cache = ProjectDataCache(
+    ttl=float(os.getenv("PROJECT_DATA_CACHE_TTL", 300)),
+    max_size=int(os.getenv("PROJECT_DATA_CACHE_SIZE", 128)),
+)
+
+
+class ProjectDataCacheCollector(Collector):
+    """Exports the lookups counted by the project data cache as the counter rag_project_data_cache_requests_total."""
+
+    def collect(self):
+        requests = CounterMetricFamily("rag_project_data_cache_requests", "Lookups from the project data cache by result.", labels=["result"])
+        requests.add_metric(["hit"], project_data_cache.hits)
+        requests.add_metric(["miss"], project_data_cache.misses)
+        yield requests
+
+
+REGISTRY.register(ProjectDataCacheCollector())
+
+# 'compact' renders tables in columns and summarises older weeks of metrics. 'verbose' renders every value as a key-value pair.
+project_data_format = os.getenv("PROJECT_DATA_FORMAT", "compact")
+# Number of latest weeks of metrics rendered in full in the compact format. Older weeks are summarised.
+project_data_recent_weeks = int(os.getenv("PROJECT_DATA_RECENT_WEEKS", 4))
 
 sql_path = "./database/sql/"
 sql_files = os.listdir(sql_path)
-sql_files = [f for f in sql_files if f.endswith(".sql")]
+sql_files = sorted(f for f in sql_files if f.endswith(".sql"))
 
 # Maps file names to a file-level description.
 file_format_mapping = {
@@ -64,8 +100,44 @@ metrics_overall_status_mapping = {
 }
 
 
+def read_sql_file(file: str) -> str:
+    """Reads the query contained in an SQL file.
+
+    Args:
+        file (str): Path to the SQL file.
+
+    Returns:
+        str: The SQL query.
+    """
+    with open(file, "r") as f:
+        return f.read()
+
+# Keys are SQL file names, values are the queries. The files are read once at import.
+sql_queries = {f: read_sql_file(sql_path+f) for f in sql_files}
+
+# The queries of a project are executed concurrently, each on its own pooled connection.
+query_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("DB_QUERY_WORKERS", max(len(sql_files), 1))),
+    thread_name_prefix="sql_executor",
+)
+
+
+def get_database():
+    """Gets the connector of the MMT database. Creates it on first use.
+
+    Returns:
+        DatabaseConnector: The connector.
+    """
+    global db
+    if db is None:
+        with db_lock:
+            if db is None:
+                from database.database_connector import DatabaseConnector
+                db = DatabaseConnector()
+    return db
+
 def execute_sql_file(file: str, project_id: int):
-    """Opens an SQL file and executes the contained query in the connected MMT database.
+    """Executes the query of an SQL file in the connected MMT database as a prepared statement.
 
     Args:
         file (str): The name of the SQL file to execute.
@@ -74,9 +146,7 @@ def execute_sql_file(file: str, project_id: int):
     Returns:
         _type_: A data structure containing the query results.
     """
-    f = open(file, "r")
-    sql = f.read()
-    return db.query(sql, (project_id,))
+    return get_database().query(sql_queries[file], (project_id,), prepared=True)
 
 def map_identifier_values(key: str, value: int) -> str:
     """Maps database ID values into textual descriptions. Handles all possible mappings.
@@ -156,6 +226,164 @@ def format_generic_data(file: str, data: List[Dict]) -> str:
         formatted_data.append(", ".join(formatted_items))
     return "\n".join(formatted_data)
 
+def format_compact_table(data: List[Dict]) -> str:
+    """Formats results from an SQL query as a table with a header row and one row per result.
+
+    Args:
+        data (List[Dict]): Results of an SQL select query.
+
+    Returns:
+        str: Formatted data.
+    """
+    formatted_data = [" | ".join(data[0].keys())]
+    for item in data:
+        formatted_data.append(" | ".join(str(map_identifier_values(key, value)) for key, value in item.items()))
+    return "\n".join(formatted_data)
+
+def pivot_metrics(data: List[Dict]) -> List[Dict]:
+    """Collects results from the project metrics query into one row per week.
+
+    Args:
+        data (List[Dict]): Results of the project metrics query.
+
+    Returns:
+        List[Dict]: One dict per week, ordered by week, with the week number, working hours, meetings, and each metric.
+    """
+    weeks = {}
+    for row in data:
+        if row.get("week") is None: # Projects without weekly reports.
+            continue
+        week_num = int(row.get("week"))
+        if week_num not in weeks:
+            weeks[week_num] = {"week": week_num, "hours": row.get("duration") or 0, "meetings": row.get("meetings") or 0}
+        weeks[week_num][row.get("description")] = row.get("value")
+    return [weeks[week_num] for week_num in sorted(weeks)]
+
+def summarise_weeks(weeks: List[Dict]) -> str:
+    """Summarises weeks of metrics as aggregates: totals, averages, and the trend of working hours.
+
+    Args:
+        weeks (List[Dict]): Weeks as returned by ~database.sql_executor.pivot_metrics.
+
+    Returns:
+        str: The summary.
+    """
+    hours = [float(week["hours"]) for week in weeks]
+    summary = [
+        f"Weeks {weeks[0]['week']}-{weeks[-1]['week']} summary: total hours {sum(hours):.1f}",
+        f"average hours per week {sum(hours) / len(hours):.1f}",
+        f"average meetings {sum(float(week['meetings']) for week in weeks) / len(weeks):.1f}",
+    ]
+    if len(hours) > 1: # Comparing the average hours of the first and second half.
+        half = len(hours) // 2
+        first, second = sum(hours[:half]) / half, sum(hours[half:]) / (len(hours) - half)
+        trend = "rising" if second > first * 1.1 else "falling" if second < first * 0.9 else "steady"
+        summary.append(f"hours trend {trend}")
+    descriptions = [key for key in weeks[-1] if key not in ("week", "hours", "meetings")]
+    for description in descriptions:
+        values = [week[description] for week in weeks if week.get(description) is not None]
+        if description == "overallStatus": # Counts of each status instead of an average.
+            counts = {}
+            for value in values:
+                status = map_metrics_values(description, value)
+                counts[status] = counts.get(status, 0) + 1
+            summary.append(f"{description} " + ", ".join(f"{status} x{count}" for status, count in counts.items()))
+        elif values:
+            summary.append(f"average {description} {sum(float(value) for value in values) / len(values):.1f}")
+    return ", ".join(summary)
+
+def format_compact_metrics(data: List[Dict], recent_weeks: int) -> str:
+    """Formats results from the project metrics query as a table of the latest weeks and a summary of older weeks.
+
+    Args:
+        data (List[Dict]): Results of the project metrics query.
+        recent_weeks (int): Number of latest weeks to render in full.
+
+    Returns:
+        str: Formatted data.
+    """
+    weeks = pivot_metrics(data)
+    if not weeks:
+        return ""
+    older, recent = (weeks[:-recent_weeks], weeks[-recent_weeks:]) if recent_weeks > 0 else (weeks, [])
+    formatted_data = []
+    if older:
+        formatted_data.append(summarise_weeks(older))
+    if recent:
+        columns = list(recent[-1].keys())
+        formatted_data.append(" | ".join(columns))
+        for week in recent:
+            values = []
+            for key in columns:
+                value = week.get(key)
+                if key == "hours":
+                    value = f"{value:.1f}"
+                elif key not in ("week", "meetings") and value is not None:
+                    value = map_metrics_values(key, value)
+                values.append(str(value))
+            formatted_data.append(" | ".join(values))
+    return "\n".join(formatted_data)
+
+def compact_renderings(file: str, data: List[Dict]) -> Iterator[str]:
+    """Renders results from an SQL query in the compact format at decreasing levels of detail.
+
+    Metrics are summarised a few more weeks at a time. Other tables are cut to half of the rows at a time.
+
+    Args:
+        file (str): The name of the file. Used to define special formatting for specific queries.
+        data (List[Dict]): Results of an SQL select query.
+
+    Yields:
+        Iterator[str]: The formatted data with its file-level description, from the most to the least detailed.
+    """
+    template = file_format_mapping.get(file, "Data:\n{}")
+    if "metrics" in file:
+        recent_weeks = min(project_data_recent_weeks, len(pivot_metrics(data)))
+        while True:
+            yield template.format(format_compact_metrics(data, recent_weeks))
+            if recent_weeks == 0:
+                return
+            recent_weeks //= 2
+    rows = len(data)
+    while rows > 0:
+        omitted = f"\n({len(data) - rows} more rows omitted)" if rows < len(data) else ""
+        yield template.format(format_compact_table(data[:rows]) + omitted)
+        rows //= 2
+
+def format_project_data(results: List[Tuple[str, List[Dict]]], token_budget: int, count_tokens: Callable[[str], int]) -> Tuple[str, Dict[str, int]]:
+    """Formats query results to fit a token budget.
+
+    In the compact format the section using the most tokens is reduced in detail until the data fits.
+    If the least detailed renderings still do not fit, the largest sections are left out.
+
+    Args:
+        results (List[Tuple[str, List[Dict]]]): The results as (file name, rows) -tuples.
+        token_budget (int): Maximum number of tokens in the formatted data.
+        count_tokens (Callable[[str], int]): Counts the tokens of a text, e.g. ~rag.tokens.count_tokens.
+
+    Returns:
+        Tuple[str, Dict[str, int]]: The formatted data and the token cost of each included section by file name.
+    """
+    if project_data_format == "compact":
+        renderings = {f: compact_renderings(f, rows) for (f, rows) in results}
+    else:
+        renderings = {f: iter([format_query_results(f, rows)]) for (f, rows) in results}
+    sections = {f: next(renderings[f], "") for f in renderings}
+    costs = {f: count_tokens(sections[f]) for f in sections}
+    reducible = set(sections)
+    while sum(costs.values()) > token_budget and reducible:
+        f = max((f for f in sections if f in reducible), key=costs.get) # Ties go to the first section, so the output is deterministic.
+        section = next(renderings[f], None)
+        if section is None:
+            reducible.discard(f)
+            continue
+        sections[f], costs[f] = section, count_tokens(section)
+    while sum(costs.values()) > token_budget:
+        f = max(costs, key=costs.get)
+        logger.debug("Left out project data section over the token budget", extra={"section": f, "tokens": costs[f], "token_budget": token_budget})
+        del sections[f], costs[f]
+    return "\n".join(sections[f] for (f, _) in results if f in sections), costs
+
 def format_query_results(file: str, results: List[Dict]) -> str:
     """Formats the file-level description for a specific SQL query. Handles all nested formatting.
 
@@ -168,8 +396,49 @@ def format_query_results(file: str, results: List[Dict]) -> str:
     """
     return file_format_mapping.get(file, "Data:\n{}").format(format_generic_data(file, results))
 
+def load_project_data(project_id: int) -> Tuple[List[Tuple[str, List[Dict]]], str]:
+    """Executes all defined queries for a project and formats the results. Bypasses the cache.
+
+    Args:
+        project_id (int): The project on which to execute the queries on.
+
+    Returns:
+        Tuple[List[Tuple[str, List[Dict]]], str]: The raw results as (file name, rows) -tuples and the formatted project data.
+            None if none of the queries returned data.
+    """
+    results = query_executor.map(partial(execute_sql_file, project_id=project_id), sql_files)
+    all_query_results = [(f, result) for (f, result) in zip(sql_files, results) if result]
+    if not all_query_results:
+        return None
+    formatted_data = [format_query_results(f, results) for (f, results) in all_query_results]
+    return all_query_results, "\n".join(formatted_data)
+
+def get_query_results(file: str, project_id: int) -> List[Dict]:
+    """Returns the raw results of a single defined query. Served from the project data cache when possible.
+
+    Args:
+        file (str): The name of the SQL file to execute.
+        project_id (int): The project on which to execute the query on.
+
+    Returns:
+        List[Dict]: The rows returned by the query. Empty if the query returned no data.
+    """
+    return project_data_cache.get(f"{project_id}/{file}", partial(execute_sql_file, file, project_id)) or []
+
+def get_project_results(project_id: int) -> List[Tuple[str, List[Dict]]]:
+    """Returns the raw results of all defined queries. Served from the project data cache when possible.
+
+    Args:
+        project_id (int): The project on which to execute the queries on.
+
+    Returns:
+        List[Tuple[str, List[Dict]]]: The results as (file name, rows) -tuples for queries which returned data.
+    """
+    cached = project_data_cache.get(str(project_id), partial(load_project_data, project_id))
+    return cached[0] if cached else []
+
 def get_project_data(project_id: int) -> str:
-    """Returns formatted project data from all defined queries.
+    """Returns formatted project data from all defined queries. Served from the project data cache when possible.
 
     Args:
         project_id (int): The project on which to execute the queries on.
@@ -177,7 +446,20 @@ def get_project_data(project_id: int) -> str:
     Returns:
         str: Formatted project data.
     """
-    all_query_results = [(f, result) for (f, result) in ((f, execute_sql_file(sql_path+f, project_id)) for f in sql_files) if result]
-    formatted_data = [format_query_results(f, results) for (f, results) in all_query_results]
-    return "\n".join(formatted_data)
+    cached = project_data_cache.get(str(project_id), partial(load_project_data, project_id))
+    return cached[1] if cached else ""
+
+def invalidate_project_data(project_id: int=None) -> None:
+    """Drops cached project data, so that the next request re-runs the queries.
+    Should be called when the project's data is known to have changed.
+
+    Args:
+        project_id (int, optional): The project whose data to drop. Drops all projects if not given. Defaults to None.
+    """
+    if project_id is None:
+        project_data_cache.clear()
+    else:
+        project_data_cache.invalidate(str(project_id))
+        for file in sql_files:
+            project_data_cache.invalidate(f"{project_id}/{file}")
 
@@ -1,9 +1,34 @@
+from dotenv import load_dotenv
+
 from api import app
+from rag.clients import lazy_import
+from rag.document_manager import start_ingestion
+from rag.session_registry import session_registry
+from rag.telemetry import configure_logging
+from rag.warmup import start_warmup
 
-from rag.document_manager import add_documents_from_urls
+import os
+import threading
 
 
-if __name__ == "__main__":
-    add_documents_from_urls() # Fetch initial data into ChromaDB on startup.
-    app.run(host="0.0.0.0", port=5000, debug=True)
+load_dotenv()
+# 'wsgi' runs the Flask development server, 'asgi' runs the asynchronous app in asgi.py on Uvicorn.
+server_mode = os.getenv("SERVER_MODE", "wsgi")
+
 
+def purge_histories() -> None:
+    """Deletes the persisted histories of expired sessions periodically. The chat history is imported here, since it imports LangChain."""
+    lazy_import("rag.chat_history").purge_periodically()
+
+
+if __name__ == "__main__":
+    configure_logging() # Structured logs to standard error, configured by LOG_LEVEL and LOG_FORMAT.
+    start_ingestion() # Fetch initial data into ChromaDB on startup, and re-index changed pages periodically.
+    session_registry.start_sweeper() # Evict idle sessions in the background.
+    threading.Thread(target=purge_histories, name="history_purger", daemon=True).start() # Delete the persisted histories of expired sessions in the background.
+    start_warmup() # Load the models, the vectorstore, the database pool and recent project data in the background. /readyz reports when done.
+    if server_mode == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:app", host="0.0.0.0", port=5000)
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
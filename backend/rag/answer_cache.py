@@ -0,0 +1,105 @@
+from typing import List, Tuple
+
+import numpy as np
+import threading
+import time
+
+
+class SemanticAnswerCache:
+    def __init__(self, max_size: int, ttl: float, threshold: float):
+        """Initialises a cache of generated answers keyed by question embeddings.
+
+        A cached answer is returned for any question whose embedding is similar enough to the cached question.
+        All entries are tied to a vectorstore version and dropped when the version changes.
+
+        Args:
+            max_size (int): Maximum number of answers held. The least recently used answer is evicted first. 0 disables caching.
+            ttl (float): Seconds after which a cached answer expires.
+            threshold (float): Minimum cosine similarity between question embeddings for a hit.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version = None
+        self._embeddings = np.empty((0, 0)) # One normalised question embedding per row.
+        self._entries = [] # (prompt, answer, expiry timestamp, last used timestamp) -tuples in the order of the embedding rows.
+        self._lock = threading.Lock()
+
+    def _check_version(self, version: int) -> bool:
+        # Versions only grow. An older version comes from an answer generated before the vectorstore changed, and is not cached.
+        if self.version is not None and version < self.version:
+            return False
+        if version != self.version:
+            self._embeddings = np.empty((0, 0))
+            self._entries = []
+            self.version = version
+        return True
+
+    def _remove(self, indices: List[int]) -> None:
+        if not indices:
+            return
+        removed = set(indices)
+        keep = [i for i in range(len(self._entries)) if i not in removed]
+        self._embeddings = self._embeddings[keep]
+        self._entries = [self._entries[i] for i in keep]
+
+    def get(self, embedding: List[float], version: int) -> Tuple[str, str]:
+        """Finds a cached answer for a question similar to the given one.
+
+        Args:
+            embedding (List[float]): The embedding of the question.
+            version (int): The current version of the vectorstore.
+
+        Returns:
+            Tuple[str, str]: The prompt and the answer of the cached question. None on a miss.
+        """
+        if self.max_size <= 0:
+            return None
+        query = np.asarray(embedding, dtype=float)
+        norm = np.linalg.norm(query)
+        if norm == 0: # E.g. an empty question. Similar to nothing.
+            return None
+        query = query / norm
+        with self._lock:
+            if not self._check_version(version):
+                return None
+            now = time.monotonic()
+            self._remove([i for i, entry in enumerate(self._entries) if entry[2] <= now])
+            if not self._entries:
+                return None
+            similarities = self._embeddings @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            prompt, answer, expiry, _ = self._entries[best]
+            self._entries[best] = (prompt, answer, expiry, now)
+            return prompt, answer
+
+    def put(self, embedding: List[float], version: int, prompt: str, answer: str) -> None:
+        """Caches the answer to a question. Empty answers, e.g. of a failed generation, are not cached.
+
+        Args:
+            embedding (List[float]): The embedding of the question.
+            version (int): The version of the vectorstore the answer was generated with. Answers generated with an older version than the cached ones are not cached.
+            prompt (str): The prompt the answer was generated for.
+            answer (str): The generated answer.
+        """
+        if self.max_size <= 0 or not answer.strip():
+            return
+        row = np.asarray(embedding, dtype=float)
+        norm = np.linalg.norm(row)
+        if norm == 0: # Could not be normalised, and would make every similarity NaN.
+            return
+        row = row / norm
+        with self._lock:
+            if not self._check_version(version):
+                return
+            if len(self._entries) >= self.max_size:
+                least_recently_used = min(range(len(self._entries)), key=lambda i: self._entries[i][3])
+                self._remove([least_recently_used])
+            now = time.monotonic()
+            self._embeddings = np.vstack([self._embeddings, row]) if self._entries else row.reshape(1, -1)
+            self._entries.append((prompt, answer, now + self.ttl, now))
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,296 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage, message_to_dict, messages_from_dict
+from typing import List, Sequence
+
+from rag.clients import get_chroma_client, get_embedding_client
+from rag.session_registry import session_registry
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+# 'memory' keeps histories in memory only. 'sqlite' persists them and keeps only the recent window in memory.
+history_backend = os.getenv("HISTORY_BACKEND", "memory")
+history_db_path = os.getenv("HISTORY_DB_PATH", "./chat_history.db")
+history_window = int(os.getenv("HISTORY_WINDOW_MESSAGES", 20))
+history_memory_k = int(os.getenv("HISTORY_MEMORY_K", 4))
+# Seconds without new messages after which the persisted history and the long-term memory of a session are deleted.
+history_retention = float(os.getenv("HISTORY_RETENTION", 7 * 24 * 3600))
+history_purge_interval = float(os.getenv("HISTORY_PURGE_INTERVAL", 3600))
+
+
+class ChatHistoryStore:
+    def __init__(self, path: str):
+        """Initialises an append-only SQLite store of chat messages shared by all sessions.
+
+        Args:
+            path (str): Path to the SQLite database file.
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                type TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created REAL NOT NULL,
+                archived INTEGER NOT NULL DEFAULT 0
+            )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS chat_messages_session ON chat_messages (session_id, id)")
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Appends messages to the history of a session.
+
+        Args:
+            session_id (str): ID of the session.
+            messages (Sequence[BaseMessage]): The messages to append.
+        """
+        rows = [(session_id, m.type, json.dumps(message_to_dict(m)), time.time()) for m in messages]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO chat_messages (session_id, type, message, created) VALUES (?, ?, ?, ?)", rows)
+
+    def load_window(self, session_id: str, window: int) -> List[BaseMessage]:
+        """Loads the system messages and the latest messages of a session.
+
+        Args:
+            session_id (str): ID of the session.
+            window (int): Number of latest messages to load.
+
+        Returns:
+            List[BaseMessage]: The messages in the order they were added.
+        """
+        with self.lock:
+            rows = self.connection.execute("""SELECT id, message FROM chat_messages WHERE session_id = ? AND type = 'system'
+                UNION SELECT * FROM (SELECT id, message FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)
+                ORDER BY id""", (session_id, session_id, window)).fetchall()
+        return messages_from_dict([json.loads(message) for _, message in rows])
+
+    def take_unarchived(self, session_id: str, window: int) -> List[tuple]:
+        """Gets the messages of a session which have fallen out of the recent window and have not been archived yet.
+
+        Args:
+            session_id (str): ID of the session.
+            window (int): Number of latest messages in the window.
+
+        Returns:
+            List[tuple]: The messages as (id, type, message JSON) -tuples.
+        """
+        with self.lock:
+            return self.connection.execute("""SELECT id, type, message FROM chat_messages
+                WHERE session_id = ? AND type != 'system' AND archived = 0
+                AND id < (SELECT MIN(id) FROM (SELECT id FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?))
+                ORDER BY id""", (session_id, session_id, window)).fetchall()
+
+    def mark_archived(self, ids: List[int]) -> None:
+        """Marks messages as archived into long-term memory.
+
+        Args:
+            ids (List[int]): IDs of the messages.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE chat_messages SET archived = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def clear(self, session_id: str) -> None:
+        """Deletes the history of a session.
+
+        Args:
+            session_id (str): ID of the session.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+
+    def delete_inactive(self, before: float) -> List[str]:
+        """Deletes the histories of sessions without messages since a point in time.
+
+        Args:
+            before (float): Unix timestamp. Histories whose latest message is older are deleted.
+
+        Returns:
+            List[str]: IDs of the sessions whose histories were deleted.
+        """
+        with self.lock, self.connection:
+            session_ids = [row[0] for row in self.connection.execute(
+                "SELECT session_id FROM chat_messages GROUP BY session_id HAVING MAX(created) < ?", (before,))]
+            self.connection.executemany("DELETE FROM chat_messages WHERE session_id = ?", [(i,) for i in session_ids])
+        return session_ids
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self, store: ChatHistoryStore, session_id: str, window: int):
+        """Initialises a persistent chat message history which holds only the recent window in memory.
+
+        The window is loaded lazily on first access. Messages which fall out of the window are embedded
+        into the long-term memory of the session in the background.
+
+        Args:
+            store (ChatHistoryStore): The store the messages are persisted in.
+            session_id (str): ID of the session.
+            window (int): Number of latest messages held in memory.
+        """
+        self.store = store
+        self.session_id = session_id
+        self.window = window
+        self._messages = None
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self._lock:
+            if self._messages is None:
+                self._messages = self.store.load_window(self.session_id, self.window)
+            return list(self._messages)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Appends messages to the store and to the window. Archives messages which fall out of the window.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to add.
+        """
+        self.store.append(self.session_id, messages)
+        with self._lock:
+            if self._messages is None:
+                self._messages = self.store.load_window(self.session_id, self.window)
+            else:
+                self._messages.extend(messages)
+                # System messages stay in the window, like in ~rag.chat_history.ChatHistoryStore.load_window.
+                system = [m for m in self._messages[:-self.window] if isinstance(m, SystemMessage)]
+                self._messages = system + self._messages[-self.window:]
+        memory_executor.submit(archive_messages, self.store, self.session_id, self.window)
+
+    def clear(self) -> None:
+        """Deletes the history and the long-term memory of the session."""
+        self.store.clear(self.session_id)
+        with self._lock:
+            self._messages = []
+        delete_memory(self.session_id)
+
+
+# Archiving runs in a single background thread, so that answers do not wait for the embeddings.
+memory_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history_memory")
+
+history_store = ChatHistoryStore(history_db_path) if history_backend == "sqlite" else None
+
+
+def get_memory_collection_name(session_id: str) -> str:
+    """Gets the name of the Chroma collection holding the long-term memory of a session.
+
+    Args:
+        session_id (str): ID of the session.
+
+    Returns:
+        str: The collection name.
+    """
+    return f"history_{session_id}"
+
+def delete_memory(session_id: str) -> None:
+    """Deletes the long-term memory of a session.
+
+    Args:
+        session_id (str): ID of the session.
+    """
+    try:
+        get_chroma_client().delete_collection(get_memory_collection_name(session_id))
+    except Exception:
+        pass # The session had no long-term memory.
+
+def archive_messages(store: ChatHistoryStore, session_id: str, window: int) -> None:
+    """Embeds the messages of a session which have fallen out of the recent window into its long-term memory.
+
+    Args:
+        store (ChatHistoryStore): The store the messages are persisted in.
+        session_id (str): ID of the session.
+        window (int): Number of latest messages in the window.
+    """
+    rows = store.take_unarchived(session_id, window)
+    if not rows:
+        return
+    try:
+        texts = [messages_from_dict([json.loads(message)])[0].text() for _, _, message in rows]
+        embeddings = get_embedding_client().embed_documents(texts)
+        collection = get_chroma_client().get_or_create_collection(name=get_memory_collection_name(session_id))
+        collection.upsert(
+            ids=[str(i) for i, _, _ in rows],
+            embeddings=embeddings,
+            documents=texts,
+            metadatas=[{"type": message_type, "id": i} for i, message_type, _ in rows],
+        )
+        store.mark_archived([i for i, _, _ in rows])
+    except Exception as e:
+        logger.error("Archiving messages failed", extra={"session_id": session_id, "error": str(e)})
+
+def create_history(session_id: str) -> BaseChatMessageHistory:
+    """Creates the message history of a session with the backend set by HISTORY_BACKEND.
+
+    Args:
+        session_id (str): ID of the session.
+
+    Returns:
+        BaseChatMessageHistory: The message history. Persisted histories contain the earlier messages of the session.
+    """
+    if history_store is None:
+        return InMemoryChatMessageHistory()
+    return SQLiteChatMessageHistory(history_store, session_id, history_window)
+
+def recall_memories(session_id: str, question: str, question_embedding: List[float]=None, k: int=history_memory_k) -> List[str]:
+    """Retrieves the earlier messages of a session most similar to the question from its long-term memory.
+
+    Args:
+        session_id (str): ID of the session.
+        question (str): The user query.
+        question_embedding (List[float], optional): The embedding of the user query. Embedded only if the session has long-term memory and it is not given. Defaults to None.
+        k (int, optional): Maximum number of messages to retrieve. Defaults to history_memory_k.
+
+    Returns:
+        List[str]: The messages in the order they were sent, prefixed with the sender. Empty without long-term memory.
+    """
+    if history_store is None or k <= 0:
+        return []
+    try:
+        collection = get_chroma_client().get_collection(name=get_memory_collection_name(session_id))
+    except Exception:
+        return [] # Nothing has been archived yet.
+    if question_embedding is None:
+        question_embedding = get_embedding_client().embed_query(question)
+    results = collection.query(query_embeddings=[question_embedding], n_results=min(k, collection.count()))
+    memories = sorted(zip(results["metadatas"][0], results["documents"][0]), key=lambda memory: memory[0]["id"])
+    return [f"{'User' if metadata['type'] == 'human' else 'Assistant'}: {document}" for metadata, document in memories]
+
+def purge_expired_histories(retention: float=history_retention) -> int:
+    """Deletes the persisted histories and the long-term memories of sessions without messages within the retention period.
+    The sessions are also evicted from memory, so that a session returning later starts over instead of seeing a partial history.
+
+    Args:
+        retention (float, optional): Seconds without new messages after which a session expires. Defaults to history_retention.
+
+    Returns:
+        int: The number of deleted histories.
+    """
+    if history_store is None:
+        return 0
+    session_ids = history_store.delete_inactive(time.time() - retention)
+    for session_id in session_ids:
+        session_registry.evict(session_id)
+        # Deleted in the archiving thread, so that a pending archive of the session cannot recreate the memory afterwards.
+        memory_executor.submit(delete_memory, session_id)
+    if session_ids:
+        logger.info("Deleted expired chat histories", extra={"sessions": len(session_ids)})
+    return len(session_ids)
+
+def purge_periodically() -> None:
+    """Deletes expired histories in a loop. Meant to be run in a background thread. Returns at once with the 'memory' backend."""
+    while history_store is not None:
+        try:
+            purge_expired_histories()
+        except Exception as e:
+            logger.error("Deleting expired chat histories failed", extra={"error": str(e)})
+        time.sleep(history_purge_interval)
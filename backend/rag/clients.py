@@ -0,0 +1,117 @@
+from dotenv import load_dotenv
+from types import ModuleType
+from typing import Any, Callable
+
+import importlib
+import logging
+import os
+import threading
+import time
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+model_name = os.environ["MODEL_NAME"]
+embedding_model_name = os.environ["EMBEDDING_MODEL_NAME"]
+ollama_timeout = float(os.getenv("OLLAMA_TIMEOUT", 300))
+ollama_retries = int(os.getenv("OLLAMA_RETRIES", 2))
+ollama_max_connections = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 32))
+# Seconds Ollama keeps the models loaded after a request, -1 for as long as it runs. Processed prompt prefixes stay cached while a model is loaded.
+ollama_keep_alive = int(os.getenv("OLLAMA_KEEP_ALIVE", 1800))
+chroma_path = os.getenv("CHROMA_PATH", "./chroma_db")
+
+# The model and vectorstore clients are created on first use, and their libraries imported only then,
+# so that starting the API, or running maintenance tasks which do not need them, does not pay for the whole stack.
+clients = {} # Keys are client names, values are the created clients.
+# Serialises creating clients and importing modules lazily, since LangChain and pydantic fail when first imported from several threads at once.
+# Reentrant, since creating a client may get other clients, and a lazily imported module may create clients at import.
+clients_lock = threading.RLock()
+
+
+def get_client(name: str, create: Callable[[], Any]) -> Any:
+    """Gets a shared client. Creates it on first use. Concurrent first uses create the client once.
+
+    Args:
+        name (str): Name of the client.
+        create (Callable[[], Any]): Function creating the client.
+
+    Returns:
+        Any: The client.
+    """
+    client = clients.get(name)
+    if client is not None:
+        return client
+    with clients_lock:
+        client = clients.get(name)
+        if client is None:
+            start_time = time.perf_counter()
+            client = clients[name] = create()
+            logger.debug("Created client", extra={"client": name, "duration": round(time.perf_counter() - start_time, 4)})
+        return client
+
+def lazy_import(name: str) -> ModuleType:
+    """Imports a module on first use. Heavy modules imported after startup should be imported with this, so that threads do not import them concurrently.
+
+    Args:
+        name (str): Absolute name of the module.
+
+    Returns:
+        ModuleType: The module.
+    """
+    with clients_lock:
+        return importlib.import_module(name)
+
+def create_ollama_client_kwargs() -> dict:
+    """Creates the connection options of the model clients.
+    All model clients share one keep-alive connection pool for sync and one for async requests. The transports retry failed connection attempts.
+
+    Returns:
+        dict: Keyword arguments for ChatOllama and OllamaEmbeddings.
+    """
+    import httpx
+    connection_limits = httpx.Limits(max_connections=ollama_max_connections, max_keepalive_connections=ollama_max_connections)
+    return {
+        "client_kwargs": {"timeout": ollama_timeout},
+        "sync_client_kwargs": {"transport": httpx.HTTPTransport(retries=ollama_retries, limits=connection_limits)},
+        "async_client_kwargs": {"transport": httpx.AsyncHTTPTransport(retries=ollama_retries, limits=connection_limits)},
+    }
+
+def create_chat_client():
+    """Creates the chat model client. Use ~rag.clients.get_chat_client instead."""
+    from langchain_ollama import ChatOllama
+    from rag.models import InFlightCallbackHandler
+    return ChatOllama(model=model_name, keep_alive=ollama_keep_alive, callbacks=[InFlightCallbackHandler()], **get_client("ollama_client_kwargs", create_ollama_client_kwargs))
+
+def create_embedding_client():
+    """Creates the embedding model client. Use ~rag.clients.get_embedding_client instead."""
+    from rag.models import PooledOllamaEmbeddings
+    return PooledOllamaEmbeddings(model=embedding_model_name, keep_alive=ollama_keep_alive, **get_client("ollama_client_kwargs", create_ollama_client_kwargs))
+
+def create_chroma_client():
+    """Creates the Chroma client. Use ~rag.clients.get_chroma_client instead."""
+    import chromadb
+    return chromadb.PersistentClient(path=chroma_path)
+
+def get_chat_client():
+    """Gets the chat model client shared by every pipeline stage. Stage specific options are bound per call by ~rag.models.get_chat_model.
+
+    Returns:
+        ChatOllama: The client.
+    """
+    return get_client("chat", create_chat_client)
+
+def get_embedding_client():
+    """Gets the embedding model client shared by ingestion, retrieval, routing and the chat history.
+
+    Returns:
+        PooledOllamaEmbeddings: The client.
+    """
+    return get_client("embedding", create_embedding_client)
+
+def get_chroma_client():
+    """Gets the client of the persistent Chroma vectorstore at CHROMA_PATH.
+
+    Returns:
+        chromadb.ClientAPI: The client.
+    """
+    return get_client("chroma", create_chroma_client)
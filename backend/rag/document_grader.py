@@ -1,16 +1,23 @@
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain.prompts import PromptTemplate
-from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import JsonOutputParser
+from prometheus_client import Histogram
 from typing import List
 
+from rag.models import get_chat_model
+
+import asyncio
 import os
+import weakref
 
 
-load_dotenv()
-model_name = os.environ["MODEL_NAME"]
+# 'sequential' grades one document at a time, 'concurrent' grades documents in parallel, 'batched' grades all documents in one call.
+grader_mode = os.getenv("GRADER_MODE", "sequential")
+grader_concurrency = int(os.getenv("GRADER_CONCURRENCY", 4))
+# Grading stops once this many relevant documents are found. 0 grades all documents.
+grader_min_relevant = int(os.getenv("GRADER_MIN_RELEVANT", 0))
 
-llm = ChatOllama(model=model_name, format="json", temperature=0)
+llm = get_chat_model(json=True, temperature=0, retry=True, lane="auxiliary")
 
 system_prompt = """You are a grader assessing relevance of a retrieved document to a user question.
 Here is the retrieved document:\n\n{document}\n
@@ -27,6 +34,35 @@ prompt_template = PromptTemplate(
 
 chain = prompt_template | llm | JsonOutputParser()
 
+batch_system_prompt = """You are a grader assessing relevance of retrieved documents to a user question.
+Here are the retrieved documents, each starting with its number in brackets:\n\n{documents}\n
+Here is the user question:\n\n{question}\n
+If a document contains keywords relevant to the user question, grade it as relevant.
+The test does not have to be stringent. The goal is to filter out erroneous retrievals.
+Give a binary score 'yes' or 'no' for each document based on whether the document is relevant to the question.
+Provide the scores as JSON with a single key 'scores' containing a list of one score per document in the given order, and no preamble or explanation."""
+
+batch_prompt_template = PromptTemplate(
+    template=batch_system_prompt,
+    input_variables=["question", "documents"],
+)
+
+batch_chain = batch_prompt_template | llm | JsonOutputParser()
+
+# Shared by all requests, so the number of concurrent grading calls to the model is capped for the whole process.
+grader_executor = ThreadPoolExecutor(max_workers=grader_concurrency, thread_name_prefix="document_grader")
+
+# Caps the number of concurrent grading calls made by the asynchronous pipeline. Keys are event loops, since a semaphore
+# belongs to the loop it is first used on, and the tests and the benchmarks run several loops in one process.
+async_grader_semaphores = weakref.WeakKeyDictionary()
+
+grading_latency = Histogram(
+    "rag_grading_duration_seconds",
+    "Time spent grading the retrieved documents of one question.",
+    ["mode"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80),
+)
+
 
 def grade_document(question: str, document: str) -> str:
     """Grades the relevancy of a document against a user question.
@@ -41,18 +77,210 @@ def grade_document(question: str, document: str) -> str:
     result = chain.invoke({"question": question, "document": document})
     return result.get("score")
 
-def filter_irrelevant_documents(question: str, documents: List[str]) -> List[str]:
-    """Removes any irrelevant documents from a list based on the relevancy of the question.
+def grade_documents_batched(question: str, documents: List[str]) -> List[str]:
+    """Grades the relevancy of several documents against a user question with a single LLM call.
+
+    Args:
+        question (str): The question input by the user.
+        documents (List[str]): The documents whose relevancy to grade.
+
+    Returns:
+        List[str]: The grades 'yes' or 'no' in the order of the documents. None if the model did not return one grade per document.
+    """
+    result = batch_chain.invoke({"question": question, "documents": number_documents(documents)})
+    return parse_batched_grades(result, len(documents))
+
+def number_documents(documents: List[str]) -> str:
+    """Formats documents as a numbered list for batched grading.
+
+    Args:
+        documents (List[str]): The documents to grade.
+
+    Returns:
+        str: The numbered documents.
+    """
+    return "\n\n".join(f"[{i}] {doc}" for i, doc in enumerate(documents, start=1))
+
+def parse_batched_grades(result: dict, document_count: int) -> List[str]:
+    """Validates the output of a batched grading call.
+
+    Args:
+        result (dict): The parsed JSON output of the model.
+        document_count (int): The number of graded documents.
+
+    Returns:
+        List[str]: The grades 'yes' or 'no' in the order of the documents. None if the model did not return one grade per document.
+    """
+    scores = result.get("scores") if isinstance(result, dict) else None
+    if not isinstance(scores, list) or len(scores) != document_count:
+        return None
+    return [str(score).lower() for score in scores]
+
+def filter_sequentially(question: str, documents: List[str], min_relevant: int) -> List[str]:
+    """Grades documents one at a time in retrieval order.
 
     Args:
         question (str): The user question based on which to grade the relevancy of the documents.
         documents (List[str]): The documents whose relevancy to grade.
+        min_relevant (int): Stop once this many relevant documents are found. 0 grades all documents.
 
     Returns:
-        List[str]: A list containing only the relevant documents from the documents list given as argument.
+        List[str]: The relevant documents in their original order.
     """
     relevant_documents = []
     for doc in documents:
         if grade_document(question, doc) == "yes":
             relevant_documents.append(doc)
+            if len(relevant_documents) == min_relevant:
+                break
     return relevant_documents
+
+def filter_concurrently(question: str, documents: List[str], min_relevant: int) -> List[str]:
+    """Grades documents in parallel on the shared grader executor.
+
+    Args:
+        question (str): The user question based on which to grade the relevancy of the documents.
+        documents (List[str]): The documents whose relevancy to grade.
+        min_relevant (int): Stop once this many relevant documents are found. 0 grades all documents.
+
+    Returns:
+        List[str]: The relevant documents in their original order.
+    """
+    futures = {grader_executor.submit(grade_document, question, doc): i for i, doc in enumerate(documents)}
+    relevant_indices = []
+    for future in as_completed(futures):
+        if future.result() == "yes":
+            relevant_indices.append(futures[future])
+            if len(relevant_indices) == min_relevant:
+                # Grades still queued are dropped. Those already running finish in the background.
+                for pending in futures:
+                    pending.cancel()
+                break
+    return [documents[i] for i in sorted(relevant_indices)]
+
+def filter_batched(question: str, documents: List[str], min_relevant: int) -> List[str]:
+    """Grades all documents with a single LLM call. Falls back to concurrent grading on malformed output.
+
+    Args:
+        question (str): The user question based on which to grade the relevancy of the documents.
+        documents (List[str]): The documents whose relevancy to grade.
+        min_relevant (int): Stop once this many relevant documents are found. 0 grades all documents.
+
+    Returns:
+        List[str]: The relevant documents in their original order.
+    """
+    grades = grade_documents_batched(question, documents)
+    if grades is None: # Malformed output, fall back to grading each document.
+        return filter_concurrently(question, documents, min_relevant)
+    relevant_documents = [doc for doc, grade in zip(documents, grades) if grade == "yes"]
+    return relevant_documents[:min_relevant] if min_relevant else relevant_documents
+
+def filter_irrelevant_documents(question: str, documents: List[str], mode: str=grader_mode, min_relevant: int=grader_min_relevant) -> List[str]:
+    """Removes any irrelevant documents from a list based on the relevancy of the question.
+
+    Args:
+        question (str): The user question based on which to grade the relevancy of the documents.
+        documents (List[str]): The documents whose relevancy to grade.
+        mode (str, optional): 'sequential', 'concurrent', or 'batched'. Defaults to GRADER_MODE.
+        min_relevant (int, optional): Stop grading once this many relevant documents are found. 0 grades all documents.
+            Defaults to GRADER_MIN_RELEVANT.
+
+    Returns:
+        List[str]: A list containing only the relevant documents from the documents list given as argument.
+    """
+    if not documents:
+        return []
+    filters = {
+        "sequential": filter_sequentially,
+        "concurrent": filter_concurrently,
+        "batched": filter_batched,
+    }
+    with grading_latency.labels(mode=mode).time():
+        return filters.get(mode, filter_sequentially)(question, documents, min_relevant)
+
+def get_async_grader_semaphore() -> asyncio.Semaphore:
+    """Gets the semaphore capping the concurrent grading calls made on the running event loop.
+
+    Returns:
+        asyncio.Semaphore: The semaphore of the running loop.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = async_grader_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = async_grader_semaphores[loop] = asyncio.Semaphore(grader_concurrency)
+    return semaphore
+
+async def agrade_document(question: str, document: str) -> str:
+    """Asynchronous version of ~rag.document_grader.grade_document.
+
+    Args:
+        question (str): The question input by the user.
+        document (str): The document whose relevancy to the user question is being graded.
+
+    Returns:
+        str: The grade 'yes' or 'no', whether the document is relevant to the question.
+    """
+    async with get_async_grader_semaphore():
+        result = await chain.ainvoke({"question": question, "document": document})
+    return result.get("score")
+
+async def afilter_concurrently(question: str, documents: List[str], min_relevant: int) -> List[str]:
+    """Asynchronous version of ~rag.document_grader.filter_concurrently. Grades still running on early exit are cancelled.
+
+    Args:
+        question (str): The user question based on which to grade the relevancy of the documents.
+        documents (List[str]): The documents whose relevancy to grade.
+        min_relevant (int): Stop once this many relevant documents are found. 0 grades all documents.
+
+    Returns:
+        List[str]: The relevant documents in their original order.
+    """
+    async def grade(i: int):
+        return i, await agrade_document(question, documents[i])
+
+    tasks = [asyncio.create_task(grade(i)) for i in range(len(documents))]
+    relevant_indices = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            i, grade_result = await next_done
+            if grade_result == "yes":
+                relevant_indices.append(i)
+                if len(relevant_indices) == min_relevant:
+                    break
+    finally:
+        for task in tasks:
+            task.cancel()
+    return [documents[i] for i in sorted(relevant_indices)]
+
+async def afilter_irrelevant_documents(question: str, documents: List[str], mode: str=grader_mode, min_relevant: int=grader_min_relevant) -> List[str]:
+    """Asynchronous version of ~rag.document_grader.filter_irrelevant_documents.
+
+    Args:
+        question (str): The user question based on which to grade the relevancy of the documents.
+        documents (List[str]): The documents whose relevancy to grade.
+        mode (str, optional): 'sequential', 'concurrent', or 'batched'. Defaults to GRADER_MODE.
+        min_relevant (int, optional): Stop grading once this many relevant documents are found. 0 grades all documents.
+            Defaults to GRADER_MIN_RELEVANT.
+
+    Returns:
+        List[str]: A list containing only the relevant documents from the documents list given as argument.
+    """
+    if not documents:
+        return []
+    with grading_latency.labels(mode=mode).time():
+        if mode == "batched":
+            result = await batch_chain.ainvoke({"question": question, "documents": number_documents(documents)})
+            grades = parse_batched_grades(result, len(documents))
+            if grades is not None:
+                relevant_documents = [doc for doc, grade in zip(documents, grades) if grade == "yes"]
+                return relevant_documents[:min_relevant] if min_relevant else relevant_documents
+            # Malformed output, fall back to grading each document.
+        if mode == "sequential":
+            relevant_documents = []
+            for doc in documents:
+                if await agrade_document(question, doc) == "yes":
+                    relevant_documents.append(doc)
+                    if len(relevant_documents) == min_relevant:
+                        break
+            return relevant_documents
+        return await afilter_concurrently(question, documents, min_relevant)
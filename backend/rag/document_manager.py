@@ -1,26 +1,39 @@
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_ollama import OllamaEmbeddings
-from langchain_community.vectorstores import Chroma
-from typing import List
+from functools import cache
+from requests.adapters import HTTPAdapter
+from typing import List, Set
 
-import chromadb
+from rag.clients import chroma_path, get_chroma_client, get_client, get_embedding_client, lazy_import
+from rag.keyword_index import BM25Index, reciprocal_rank_fusion
+
+import asyncio
 import hashlib
+import json
+import logging
 import requests
 import os
+import threading
+import time
 
 
 load_dotenv()
-model_name = os.environ["MODEL_NAME"]
-embedding_model_name = os.environ["EMBEDDING_MODEL_NAME"]
+logger = logging.getLogger(__name__)
 chunk_size = int(os.getenv("EMBEDDING_CHUNK_SIZE", 256))
 chunk_overlap = int(os.getenv("EMBEDDING_CHUNK_OVERLAP", 64))
-
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_or_create_collection(name="documents")
-
-embedding_model = OllamaEmbeddings(model=embedding_model_name)
+embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+refresh_interval = float(os.getenv("INGESTION_REFRESH_INTERVAL", 0))
+manifest_path = os.getenv("INGESTION_MANIFEST_PATH", os.path.join(chroma_path, "manifest.json"))
+ingest_in_background = os.getenv("INGESTION_IN_BACKGROUND", "false").lower() == "true"
+fetch_timeout = float(os.getenv("FETCH_TIMEOUT", 10))
+fetch_concurrency = int(os.getenv("FETCH_CONCURRENCY", 4))
+# 'hybrid' fuses the vectorstore and keyword search rankings. 'dense' uses the vectorstore only.
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+retrieval_top_k = int(os.getenv("RETRIEVAL_TOP_K", 10))
+# Number of candidates taken from each ranking before fusion.
+retrieval_candidates = int(os.getenv("RETRIEVAL_CANDIDATES", 20))
+# lxml is considerably faster than the pure-Python html.parser. Falls back to html.parser if it is not installed.
+html_parser = os.getenv("HTML_PARSER", "lxml")
 
 # These are fetched, parsed, and saved into the vectorstore at startup.
 urls = (
@@ -29,6 +42,91 @@ urls = (
     "https://coursepages2.tuni.fi/comp-se-610/guidelines/",
 )
 
+# A shared session keeps connections to the course pages alive between requests.
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=fetch_concurrency, pool_maxsize=fetch_concurrency))
+http_session.mount("http://", HTTPAdapter(pool_connections=fetch_concurrency, pool_maxsize=fetch_concurrency))
+
+# Keys are URLs, values contain the ETag, Last-Modified and content hash of the latest indexed version.
+# Kept next to the vectorstore, so that removing the vectorstore also resets the manifest.
+manifest = {}
+# Only one ingestion pass runs at a time, whether started at startup or by the periodic refresh.
+ingestion_lock = threading.Lock()
+# Incremented whenever documents are added or removed. Used for invalidating answers generated from older documents.
+collection_version = 0
+collection_version_lock = threading.Lock() # The version is bumped from the fetch threads of an ingestion pass.
+# Keyword index of the documents in the vectorstore. Kept up to date at ingestion, and loaded from the vectorstore on first use.
+keyword_index = BM25Index()
+keyword_index_loaded = False
+keyword_index_lock = threading.Lock()
+
+
+def get_collection():
+    """Gets the vectorstore collection of the course pages. Opened on first use.
+
+    Returns:
+        chromadb.Collection: The collection.
+    """
+    return get_client("documents", lambda: get_chroma_client().get_or_create_collection(name="documents"))
+
+@cache
+def get_html_parser() -> str:
+    """Gets the HTML parser used by BeautifulSoup. Falls back to html.parser if HTML_PARSER is not installed.
+
+    Returns:
+        str: Name of the parser.
+    """
+    builder_registry = lazy_import("bs4.builder").builder_registry
+    return html_parser if builder_registry.lookup(html_parser) is not None else "html.parser"
+
+def load_manifest() -> dict:
+    """Loads the ingestion manifest from disk.
+
+    Returns:
+        dict: The manifest. Empty if it has not been saved yet.
+    """
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest() -> None:
+    """Saves the ingestion manifest to disk."""
+    os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def fetch_url(url: str, entry: dict) -> requests.Response:
+    """Fetches a URL with a conditional GET based on the previously indexed version.
+
+    Args:
+        url (str): The URL which to retrieve.
+        entry (dict): The manifest entry of the URL. May be empty.
+
+    Returns:
+        requests.Response: The response. Status 304 if the page has not changed.
+    """
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    response = http_session.get(url, headers=headers, timeout=fetch_timeout)
+    response.raise_for_status()
+    return response
+
+def extract_text(html: str) -> str:
+    """Extracts text from an HTML document.
+
+    Args:
+        html (str): The HTML document.
+
+    Returns:
+        str: The contents of the document as text without HTML elements.
+    """
+    soup = lazy_import("bs4").BeautifulSoup(html, get_html_parser())
+    return soup.get_text(separator="\n", strip=True)
 
 def fetch_text_from_url(url: str) -> str:
     """Fetches HTML documents and extracts text.
@@ -39,9 +137,7 @@ def fetch_text_from_url(url: str) -> str:
     Returns:
         str: The contents of the URL as text without HTML elements.
     """
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    return soup.get_text(separator="\n", strip=True)
+    return extract_text(fetch_url(url, {}).text)
 
 def split_to_chunks(text: str, size: int, overlap: int) -> List[str]:
     """Splits long text into chunks of specified size and overlap.
@@ -54,91 +150,240 @@ def split_to_chunks(text: str, size: int, overlap: int) -> List[str]:
     Returns:
         List[str]: A list of the resulting text chunks.
     """
-    splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+    splitter = lazy_import("langchain.text_splitter").RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
     return splitter.split_text(text)
 
-def doc_exists(doc_id: str) -> bool:
-    """Checks whether a document with the given document ID exists in the vectorstore.
+def get_doc_ids_for_url(url: str) -> Set[str]:
+    """Gets the IDs of all documents saved from a URL with a single lookup.
 
     Args:
-        doc_id (str): The ID of the document to check.
+        url (str): The URL whose documents to look up.
 
     Returns:
-        bool: True if the document is already saved, False otherwise.
+        Set[str]: The IDs of the saved documents.
     """
-    existing_data = collection.get(ids=[doc_id], include=["metadatas"]) # include-arg just to minimise unnecessary returned data.
-    return bool(existing_data["ids"])
+    existing_data = get_collection().get(where={"url": url}, include=[]) # Empty include-arg to only return the IDs.
+    return set(existing_data["ids"])
 
-def add_document(doc_id: str, embedding: List[float], url: str, chunk: str) -> bool:
-    """Saves a document into the vectorstore.
+def add_documents(doc_ids: List[str], embeddings: List[List[float]], url: str, chunks: List[str]) -> None:
+    """Saves a batch of documents into the vectorstore with a single write.
 
     Args:
-        doc_id (str): The ID to use for the document in the vectorstore.
-        embedding (List[float]): The calculated embedding of the document.
-        url (str): The URL from which the document was retrieved.
-        chunk (str): The text chunk i.e. the document.
+        doc_ids (List[str]): The IDs to use for the documents in the vectorstore.
+        embeddings (List[List[float]]): The calculated embeddings of the documents.
+        url (str): The URL from which the documents were retrieved.
+        chunks (List[str]): The text chunks i.e. the documents.
+    """
+    get_collection().upsert(
+        ids=doc_ids,
+        embeddings=embeddings,
+        metadatas=[{"url": url} for _ in doc_ids],
+        documents=chunks
+    )
+    get_keyword_index().add(doc_ids, chunks, url)
+
+def get_keyword_index() -> BM25Index:
+    """Gets the keyword index. Builds it from the documents in the vectorstore on first use.
 
     Returns:
-        bool: True if saving was successful, False otherwise.
-    """
-    if doc_exists(doc_id):
-        return False
-    collection.add(
-        ids=[doc_id],
-        embeddings=[embedding],
-        metadatas=[{"url": url}],
-        documents=[chunk]
-    )
-    return True
+        BM25Index: The keyword index.
+    """
+    global keyword_index_loaded
+    with keyword_index_lock:
+        if not keyword_index_loaded:
+            start_time = time.perf_counter()
+            stored = get_collection().get(include=["documents", "metadatas"])
+            for doc_id, document, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"]):
+                keyword_index.add([doc_id], [document], metadata.get("url"))
+            keyword_index_loaded = True
+            logger.info("Built keyword index", extra={"chunks": len(keyword_index), "duration": round(time.perf_counter() - start_time, 4)})
+    return keyword_index
 
-def generate_doc_id(url: str, chunk_index: int) -> str:
-    """Generates an ID for a document.
+def generate_doc_id(url: str, chunk: str) -> str:
+    """Generates an ID for a document. The ID is derived from the content, so an unchanged chunk keeps its ID when the page changes.
 
     Args:
         url (str): The URL from which the document is retrieved.
-        chunk_index (int): The index of the chunk resulting from splitting the document.
+        chunk (str): The text chunk resulting from splitting the document.
 
     Returns:
         str: The document ID.
     """
-    url_hash = hashlib.md5(url.encode()).hexdigest() # hashlib.md5 is consistent, unlike Python's hash() which has randomisation.
-    return f"{url_hash}_{chunk_index}"
+    # hashlib.md5 is consistent, unlike Python's hash() which has randomisation.
+    url_hash = hashlib.md5(url.encode()).hexdigest()
+    chunk_hash = hashlib.md5(chunk.encode()).hexdigest()
+    return f"{url_hash}_{chunk_hash}"
+
+def bump_collection_version() -> None:
+    """Marks the contents of the vectorstore as changed."""
+    global collection_version
+    with collection_version_lock:
+        collection_version += 1
+
+def get_collection_version() -> int:
+    """Gets the version of the vectorstore contents. The version changes whenever documents are added or removed.
+
+    Returns:
+        int: The current version.
+    """
+    return collection_version
 
 def process_chunks(chunks: List[str], url: str) -> None:
-    """Processes text chunks. Saves them to the vectorstore, skipping existing ones.
+    """Processes text chunks. Saves new chunks to the vectorstore and removes chunks no longer present in the document.
+    New chunks are embedded and written in batches of embedding_batch_size.
 
     Args:
         chunks (List[str]): The list of chunks to save.
         url (str): The URL from which the document was retrieved.
     """
-    for i, chunk in enumerate(chunks):
-        doc_id = generate_doc_id(chunk, i)
-        embedding = embedding_model.embed_query(chunk)
-        result = add_document(doc_id, embedding, url, chunk)
-        if not result: # Move on to next document if a chunk has already been saved. TODO What about updated documents? Purge all periodically?
-            print(f"Vectorstore: Skipped existing document -> {url}")
-            return
-    print(f"Vectorstore: Document added -> {url}")
+    start_time = time.perf_counter()
+    # Keys are document IDs. Identical chunks on the same page share an ID and are saved once.
+    chunks_by_id = {generate_doc_id(url, chunk): chunk for chunk in chunks}
+    existing_doc_ids = get_doc_ids_for_url(url)
+    added = [(doc_id, chunk) for doc_id, chunk in chunks_by_id.items() if doc_id not in existing_doc_ids]
+    removed = [doc_id for doc_id in existing_doc_ids if doc_id not in chunks_by_id]
+    if removed:
+        get_collection().delete(ids=removed)
+        get_keyword_index().remove(removed)
+        bump_collection_version()
+    if not added:
+        logger.info("Skipped existing document", extra={"url": url, "removed": len(removed)})
+        return
+    for i in range(0, len(added), embedding_batch_size):
+        batch_ids, batch_chunks = (list(values) for values in zip(*added[i:i+embedding_batch_size]))
+        embeddings = get_embedding_client().embed_documents(batch_chunks)
+        add_documents(batch_ids, embeddings, url, batch_chunks)
+    bump_collection_version()
+    elapsed = time.perf_counter() - start_time
+    logger.info("Document updated", extra={"url": url, "added": len(added), "removed": len(removed), "duration": round(elapsed, 4), "chunks_per_second": round(len(added) / elapsed, 1)})
 
-def add_documents_from_urls() -> None:
-    """Adds documents from programmatically predefined URLs.
+def index_url(url: str) -> None:
+    """Indexes a URL incrementally. Unchanged pages are skipped without embedding any chunks.
+
+    Args:
+        url (str): The URL which to index.
     """
-    for url in urls:
-        text = fetch_text_from_url(url)
+    entry = manifest.get(url, {})
+    response = fetch_url(url, entry)
+    if response.status_code == 304:
+        logger.info("Skipped unmodified document", extra={"url": url})
+        return
+    text = extract_text(response.text)
+    content_hash = hashlib.md5(text.encode()).hexdigest()
+    if content_hash != entry.get("content_hash"):
         chunks = split_to_chunks(text, chunk_size, chunk_overlap)
         process_chunks(chunks, url)
+    else:
+        logger.info("Skipped unchanged document", extra={"url": url})
+    manifest[url] = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+    }
 
-def retrieve_documents(query: str, top_k: int=10):
+def index_url_safely(url: str) -> None:
+    """Indexes a URL, logging errors instead of raising them, so that one failing page does not stop the others or the saving of the manifest.
+
+    Args:
+        url (str): The URL which to index.
+    """
+    try:
+        index_url(url)
+    except requests.RequestException as e:
+        logger.error("Error fetching document", extra={"url": url, "error": str(e)})
+    except Exception as e: # E.g. the embedding model is temporarily unavailable, or the page cannot be parsed.
+        logger.error("Error indexing document", extra={"url": url, "error": str(e)})
+
+def add_documents_from_urls() -> None:
+    """Adds documents from programmatically predefined URLs. Only changed documents are re-indexed.
+    Up to fetch_concurrency URLs are fetched and indexed at the same time.
+    """
+    with ingestion_lock:
+        manifest.update(load_manifest())
+        with ThreadPoolExecutor(max_workers=fetch_concurrency, thread_name_prefix="document_fetch") as executor:
+            list(executor.map(index_url_safely, urls))
+        save_manifest()
+
+def refresh_documents_periodically(interval: float) -> None:
+    """Re-indexes the predefined URLs in a loop. Meant to be run in a background thread.
+
+    Args:
+        interval (float): Seconds to wait between refreshes.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            add_documents_from_urls()
+        except Exception as e: # Keep refreshing even if e.g. the embedding model is temporarily unavailable.
+            logger.error("Error refreshing documents", extra={"error": str(e)})
+
+def start_periodic_refresh(interval: float=refresh_interval) -> None:
+    """Starts re-indexing the predefined URLs periodically in a background thread, so that updated pages are picked up without a restart.
+
+    Args:
+        interval (float, optional): Seconds between refreshes. Does nothing if 0. Defaults to INGESTION_REFRESH_INTERVAL.
+    """
+    if interval <= 0:
+        return
+    thread = threading.Thread(target=refresh_documents_periodically, args=(interval,), name="document_refresh", daemon=True)
+    thread.start()
+
+def start_ingestion(background: bool=ingest_in_background) -> None:
+    """Fetches the predefined URLs into the vectorstore and starts the periodic refresh.
+
+    Args:
+        background (bool, optional): Whether to ingest in a background thread, so that the API can serve requests immediately.
+            Defaults to INGESTION_IN_BACKGROUND.
+    """
+    if background:
+        thread = threading.Thread(target=add_documents_from_urls, name="document_ingestion", daemon=True)
+        thread.start()
+    else:
+        add_documents_from_urls()
+    start_periodic_refresh()
+
+def retrieve_documents(query: str, top_k: int=retrieval_top_k, query_embedding: List[float]=None, urls: List[str]=None):
     """Retrieves relevant text snippets based on a similarity search performed with a query string.
 
+    In hybrid mode, the similarity search and a BM25 keyword search are fused by reciprocal rank,
+    so that snippets containing exact terms such as "sprint 3" rank high even when their embeddings do not.
+
     Args:
         query (str): The user query to search the vectorstore with.
-        top_k (int, optional): The amount of most relevant text snippets to return. Defaults to 10.
+        top_k (int, optional): The amount of most relevant text snippets to return. Defaults to retrieval_top_k.
+        query_embedding (List[float], optional): The embedding of the query, if already computed. Defaults to None.
+        urls (List[str], optional): Only snippets retrieved from these URLs are returned. All if not given. Defaults to None.
 
     Returns:
-        _type_: _description_
+        _type_: The retrieved text snippets, from the most to the least relevant.
     """
-    query_embedding = embedding_model.embed_query(query)
-    results = collection.query(query_embeddings=[query_embedding], n_results=top_k)
-    return results["documents"][0] if "documents" in results else []
+    if query_embedding is None:
+        query_embedding = get_embedding_client().embed_query(query)
+    where = {"url": {"$in": list(urls)}} if urls else None
+    if retrieval_mode != "hybrid":
+        results = get_collection().query(query_embeddings=[query_embedding], n_results=top_k, where=where)
+        return results["documents"][0] if "documents" in results else []
+    candidates = max(top_k, retrieval_candidates)
+    results = get_collection().query(query_embeddings=[query_embedding], n_results=candidates, where=where)
+    texts = dict(zip(results["ids"][0], results["documents"][0]))
+    index = get_keyword_index()
+    keyword_ranking = [doc_id for doc_id, _ in index.search(query, candidates, urls)]
+    fused = reciprocal_rank_fusion([results["ids"][0], keyword_ranking])[:top_k]
+    return [texts[doc_id] if doc_id in texts else index.get_text(doc_id) for doc_id in fused]
+
 
+async def aretrieve_documents(query: str, top_k: int=retrieval_top_k, query_embedding: List[float]=None, urls: List[str]=None):
+    """Asynchronous version of ~rag.document_manager.retrieve_documents. The vectorstore is queried outside the event loop.
+
+    Args:
+        query (str): The user query to search the vectorstore with.
+        top_k (int, optional): The amount of most relevant text snippets to return. Defaults to retrieval_top_k.
+        query_embedding (List[float], optional): The embedding of the query, if already computed. Defaults to None.
+        urls (List[str], optional): Only snippets retrieved from these URLs are returned. All if not given. Defaults to None.
+
+    Returns:
+        _type_: The retrieved text snippets.
+    """
+    if query_embedding is None:
+        query_embedding = await get_embedding_client().aembed_query(query)
+    return await asyncio.to_thread(retrieve_documents, query, top_k, query_embedding, urls)
@@ -0,0 +1,102 @@
+from array import array
+from collections import OrderedDict
+from dotenv import load_dotenv
+from prometheus_client import Counter
+from typing import List
+
+import os
+import sqlite3
+import threading
+import unicodedata
+
+
+load_dotenv()
+
+
+def normalise_text(text: str) -> str:
+    """Normalises a text for use as a cache key. Questions differing only in case, whitespace or Unicode form share a key.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        str: The normalised text.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int, path: str=None):
+        """Initialises a least recently used cache of embeddings keyed by model name and normalised text.
+
+        Args:
+            max_size (int): Maximum number of embeddings held in memory.
+            path (str, optional): Path to an SQLite file for persisting the embeddings across restarts. Not persisted if not given. Defaults to None.
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict() # Ordered from the least to the most recently used embedding.
+        self._lock = threading.Lock()
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def get(self, model: str, text: str) -> List[float]:
+        """Gets a cached embedding. Looks up the disk if the embedding is not in memory.
+
+        Args:
+            model (str): Name of the embedding model.
+            text (str): The embedded text.
+
+        Returns:
+            List[float]: The embedding. Must not be modified. None on a miss.
+        """
+        key = f"{model}\0{normalise_text(text)}"
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None and self._connection is not None:
+                row = self._connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    embedding = array("d", row[0]).tolist()
+                    self._store(key, embedding)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+        embedding_cache_requests.labels(result="hit" if embedding is not None else "miss").inc()
+        return embedding
+
+    def put(self, model: str, text: str, embedding: List[float]) -> None:
+        """Saves an embedding, evicting the least recently used one if the cache is full.
+
+        Args:
+            model (str): Name of the embedding model.
+            text (str): The embedded text.
+            embedding (List[float]): The embedding.
+        """
+        key = f"{model}\0{normalise_text(text)}"
+        with self._lock:
+            self._store(key, embedding)
+            if self._connection is not None:
+                with self._connection:
+                    self._connection.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, array("d", embedding).tobytes()))
+
+    def _store(self, key: str, embedding: List[float]) -> None:
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+embedding_cache_requests = Counter(
+    "rag_embedding_cache_requests_total",
+    "Lookups from the query embedding cache by result.",
+    ["result"],
+)
+
+embedding_cache = EmbeddingCache(
+    max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", 1024)),
+    path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+)
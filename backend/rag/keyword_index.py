@@ -0,0 +1,137 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import math
+import re
+import threading
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits a text into lowercase word and number tokens.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        List[str]: The tokens.
+    """
+    return re.findall(r"\w+", text.lower())
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int=60) -> List[str]:
+    """Fuses rankings of document IDs by reciprocal rank. Documents ranked high by any ranking come first.
+
+    Args:
+        rankings (Iterable[List[str]]): The rankings, each ordered from the best to the worst document.
+        k (int, optional): Dampens the weight of the top ranks. Defaults to 60.
+
+    Returns:
+        List[str]: The fused ranking.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    def __init__(self, k1: float=1.5, b: float=0.75):
+        """Initialises an in-process inverted index scored with BM25.
+
+        Args:
+            k1 (float, optional): Term frequency saturation. Defaults to 1.5.
+            b (float, optional): Document length normalisation. Defaults to 0.75.
+        """
+        self.k1 = k1
+        self.b = b
+        self.documents = {} # Keys are document IDs, values are (text, url, length) -tuples.
+        self.postings = defaultdict(dict) # Keys are terms, values map document IDs to term frequencies.
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, doc_ids: List[str], texts: List[str], url: str) -> None:
+        """Adds documents to the index. Documents already in the index are replaced.
+
+        Args:
+            doc_ids (List[str]): IDs of the documents.
+            texts (List[str]): The texts of the documents.
+            url (str): The URL from which the documents were retrieved.
+        """
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                self._remove(doc_id)
+                term_frequencies = Counter(tokenize(text))
+                for term, frequency in term_frequencies.items():
+                    self.postings[term][doc_id] = frequency
+                length = sum(term_frequencies.values())
+                self.documents[doc_id] = (text, url, length)
+                self.total_length += length
+
+    def remove(self, doc_ids: List[str]) -> None:
+        """Removes documents from the index. Unknown IDs are ignored.
+
+        Args:
+            doc_ids (List[str]): IDs of the documents.
+        """
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        text, _, length = document
+        self.total_length -= length
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+
+    def get_text(self, doc_id: str) -> str:
+        """Gets the text of a document.
+
+        Args:
+            doc_id (str): ID of the document.
+
+        Returns:
+            str: The text. None if the document is not in the index.
+        """
+        document = self.documents.get(doc_id)
+        return document[0] if document else None
+
+    def search(self, query: str, top_k: int, urls: Iterable[str]=None) -> List[Tuple[str, float]]:
+        """Finds the documents which best match the terms of a query.
+
+        Args:
+            query (str): The query.
+            top_k (int): Maximum number of documents to return.
+            urls (Iterable[str], optional): Only documents retrieved from these URLs are returned. All if not given. Defaults to None.
+
+        Returns:
+            List[Tuple[str, float]]: (document ID, score) -tuples from the best to the worst match.
+        """
+        urls = set(urls) if urls else None
+        scores: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            count = len(self.documents)
+            if count == 0:
+                return []
+            average_length = self.total_length / count
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    _, url, length = self.documents[doc_id]
+                    if urls is not None and url not in urls:
+                        continue
+                    normalisation = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + normalisation)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def __len__(self) -> int:
+        return len(self.documents)
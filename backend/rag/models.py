@@ -0,0 +1,136 @@
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.tools import BaseTool
+from langchain_ollama import OllamaEmbeddings
+from prometheus_client import Gauge
+from typing import Any, List
+
+from rag.clients import get_chat_client, ollama_retries
+from rag.embedding_cache import embedding_cache
+from rag.scheduler import scheduler
+from rag.tokens import count_tokens
+
+import asyncio
+
+
+message_overhead_tokens = 3 # Role and separator tokens added to each message by the chat template.
+
+in_flight_requests = Gauge("ollama_requests_in_flight", "Number of requests to Ollama in progress.", ["kind"])
+
+
+class InFlightCallbackHandler(BaseCallbackHandler):
+    """Counts the chat model calls in progress."""
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        in_flight_requests.labels(kind="chat").inc()
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        in_flight_requests.labels(kind="chat").dec()
+
+    def on_llm_error(self, error, **kwargs) -> None:
+        in_flight_requests.labels(kind="chat").dec()
+
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings which counts the embedding calls in progress, and caches query embeddings."""
+
+    def embed_query(self, text: str) -> List[float]:
+        embedding = embedding_cache.get(self.model, text)
+        if embedding is None:
+            embedding = super().embed_query(text)
+            embedding_cache.put(self.model, text, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # The cache may read from and write to its SQLite file, which must not block the event loop.
+        embedding = await asyncio.to_thread(embedding_cache.get, self.model, text)
+        if embedding is None:
+            embedding = await super().aembed_query(text)
+            await asyncio.to_thread(embedding_cache.put, self.model, text, embedding)
+        return embedding
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with in_flight_requests.labels(kind="embedding").track_inprogress():
+            return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with in_flight_requests.labels(kind="embedding").track_inprogress():
+            return await super().aembed_documents(texts)
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """Counts the tokens of a message. The count is memoised in the message metadata, so each message is counted once.
+
+    Args:
+        message (BaseMessage): The message.
+
+    Returns:
+        int: The number of tokens.
+    """
+    count = message.response_metadata.get("token_count")
+    if count is None:
+        count = count_tokens(message.text()) + message_overhead_tokens
+        message.response_metadata["token_count"] = count
+    return count
+
+def count_messages_tokens(messages: List[BaseMessage]) -> int:
+    """Counts the tokens of messages. Can be used as the token_counter of trim_messages.
+
+    Args:
+        messages (List[BaseMessage]): The messages.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return sum(count_message_tokens(message) for message in messages)
+
+def schedule(model: Runnable, lane: str) -> Runnable:
+    """Wraps a model so that every call waits for a slot in a scheduler lane. Supports invoke and ainvoke, not streaming.
+
+    Args:
+        model (Runnable): The model to wrap.
+        lane (str): Name of the scheduler lane.
+
+    Returns:
+        Runnable: The wrapped model.
+    """
+    def invoke(input: Any, config: RunnableConfig) -> Any:
+        with scheduler.slot(lane):
+            return model.invoke(input, config)
+
+    async def ainvoke(input: Any, config: RunnableConfig) -> Any:
+        async with scheduler.aslot(lane):
+            return await model.ainvoke(input, config)
+
+    return RunnableLambda(invoke, afunc=ainvoke, name=f"scheduled_{lane}")
+
+def get_chat_model(json: bool=False, temperature: float=None, retry: bool=False, lane: str=None, tools: List[BaseTool]=None) -> Runnable:
+    """Gets the shared chat model with per-call option overrides.
+
+    Args:
+        json (bool, optional): Whether the model should answer in JSON format. Defaults to False.
+        temperature (float, optional): Sampling temperature. Uses the model default if not given. Defaults to None.
+        retry (bool, optional): Whether to retry failed calls OLLAMA_RETRIES times. Should not be used for streamed answers. Defaults to False.
+        lane (str, optional): Name of the scheduler lane the calls wait in. Calls are not scheduled if not given. Defaults to None.
+        tools (List[BaseTool], optional): Tools the model may call. Defaults to None.
+
+    Returns:
+        Runnable: The chat model with the options bound.
+    """
+    overrides = {}
+    if json:
+        overrides["format"] = "json"
+    if temperature is not None:
+        # Replaces the default options of the model, none of which are set otherwise.
+        overrides["options"] = {"temperature": temperature}
+    chat_model = get_chat_client()
+    if tools:
+        model = chat_model.bind_tools(tools, **overrides)
+    else:
+        model = chat_model.bind(**overrides) if overrides else chat_model
+    if retry and ollama_retries > 0:
+        model = model.with_retry(stop_after_attempt=ollama_retries + 1)
+    if lane:
+        model = schedule(model, lane)
+    return model
@@ -0,0 +1,161 @@
+from functools import partial
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.messages.tool import ToolCall
+from langchain_core.tools import InjectedToolArg, tool
+from prometheus_client import Histogram
+from typing import Annotated, Dict, List, Tuple
+
+from database.sql_executor import format_project_data, get_query_results, query_executor
+from rag.models import get_chat_model
+from rag.tokens import count_tokens
+
+import asyncio
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of tokens of project data in a prompt.
+token_budget = int(os.getenv("PROJECT_DATA_TOKEN_BUDGET", 2048))
+# 'tools' lets the model select the data needed for each question, and adds it to the question.
+# 'prefix' renders all data of the project into the same text for every question, placed at the start of the prompt,
+# so that Ollama reuses the processed data across questions and sessions on the project. Opt-in, since every prompt then carries
+# all project data up to the token budget, and the prefix still changes daily with the current date in project_info.sql.
+project_data_mode = os.getenv("PROJECT_DATA_MODE", "tools")
+
+section_tokens = Histogram(
+    "rag_project_data_tokens",
+    "Tokens of project data included in a prompt by section.",
+    ["section"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096),
+)
+
+# Each tool is backed by one query, and returns the SQL file name and the rows for the formatter.
+# The docstrings are the tool descriptions shown to the model.
+# The project ID is injected when the tool is run, so the model never sees or chooses it.
+@tool
+def project_info(project_id: Annotated[int, InjectedToolArg]) -> Tuple[str, List[Dict]]:
+    """Gets the project name, the start and finish dates of the project, and the current date."""
+    return "project_info.sql", get_query_results("project_info.sql", project_id)
+
+@tool
+def project_working_hours(project_id: Annotated[int, InjectedToolArg]) -> Tuple[str, List[Dict]]:
+    """Gets the target and current working hours of the whole project."""
+    return "project_working_hours.sql", get_query_results("project_working_hours.sql", project_id)
+
+@tool
+def member_working_hours(project_id: Annotated[int, InjectedToolArg]) -> Tuple[str, List[Dict]]:
+    """Gets the target and current working hours of each project member."""
+    return "project_members_working_hours.sql", get_query_results("project_members_working_hours.sql", project_id)
+
+@tool
+def weekly_metrics(project_id: Annotated[int, InjectedToolArg]) -> Tuple[str, List[Dict]]:
+    """Gets the weekly reports of the project: working hours, meetings, and metrics such as overall status for each week."""
+    return "project_metrics.sql", get_query_results("project_metrics.sql", project_id)
+
+@tool
+def project_risks(project_id: Annotated[int, InjectedToolArg]) -> Tuple[str, List[Dict]]:
+    """Gets the risks of the project with their impact, probability, severity, status, cause, and mitigation."""
+    return "project_risks.sql", get_query_results("project_risks.sql", project_id)
+
+project_tools = [project_info, project_working_hours, member_working_hours, weekly_metrics, project_risks]
+tools_by_name = {t.name: t for t in project_tools}
+
+system_prompt = """You select the project data needed to answer a question about the user's software project.
+Call every tool whose data is needed to answer the question, and no other tools.
+If no project data is needed, do not call any tools."""
+
+prompt = ChatPromptTemplate.from_messages([
+    ("system", system_prompt),
+    ("human", "{question}"),
+])
+
+llm = get_chat_model(temperature=0, retry=True, lane="auxiliary", tools=project_tools)
+
+chain = prompt | llm
+
+
+def run_tool_call(tool_call: ToolCall, project_id: int) -> Tuple[str, List[Dict]]:
+    """Runs a tool called by the model on the user's project.
+
+    Args:
+        tool_call (ToolCall): The tool call from the model.
+        project_id (int): ID of the project which to run the tool on.
+
+    Returns:
+        Tuple[str, List[Dict]]: The SQL file name and the rows returned by the tool. None if the tool failed.
+    """
+    try:
+        return tools_by_name[tool_call["name"]].invoke({**tool_call["args"], "project_id": project_id})
+    except Exception as e:
+        logger.error("Project data tool failed", extra={"tool": tool_call["name"], "error": str(e)})
+        return None
+
+def run_tool_calls(tool_calls: List[ToolCall], project_id: int) -> str:
+    """Runs the tools called by the model concurrently, and formats the results to fit the token budget. Unknown tools are ignored.
+
+    Args:
+        tool_calls (List[ToolCall]): The tool calls from the model.
+        project_id (int): ID of the project which to run the tools on.
+
+    Returns:
+        str: The combined data returned by the tools.
+    """
+    # Results are cached per turn: a tool called more than once with the same arguments runs once.
+    unique_calls = {}
+    for tool_call in tool_calls:
+        if tool_call["name"] in tools_by_name:
+            unique_calls.setdefault((tool_call["name"], json.dumps(tool_call["args"], sort_keys=True)), tool_call)
+    results = query_executor.map(partial(run_tool_call, project_id=project_id), unique_calls.values())
+    results = [(f, rows) for (f, rows) in filter(None, results) if rows]
+    data, costs = format_project_data(results, token_budget, count_tokens)
+    for f, cost in costs.items():
+        section_tokens.labels(section=f.removesuffix(".sql")).observe(cost)
+    logger.debug("Project data formatted", extra={"section_tokens": costs, "tokens": sum(costs.values()), "token_budget": token_budget})
+    return data
+
+def load_project_context(project_id: int) -> str:
+    """Runs every tool on the user's project. The data is formatted deterministically, so unchanged data gives the same text.
+
+    Args:
+        project_id (int): ID of the user's project.
+
+    Returns:
+        str: All data of the project which fits the token budget.
+    """
+    return run_tool_calls([ToolCall(name=t.name, args={}, id=t.name) for t in project_tools], project_id)
+
+def fetch_project_data(question: str, project_id: int) -> str:
+    """Lets the model choose the tools needed to answer a question, and runs only those tools.
+    In 'prefix' mode all data of the project is returned without asking the model.
+
+    Args:
+        question (str): The user query.
+        project_id (int): ID of the user's project.
+
+    Returns:
+        str: The project data needed to answer the question. Empty if no data is needed.
+    """
+    if project_data_mode == "prefix":
+        return load_project_context(project_id)
+    message = chain.invoke({"question": question})
+    logger.debug("Project data tools called", extra={"tools": [tool_call["name"] for tool_call in message.tool_calls]})
+    return run_tool_calls(message.tool_calls, project_id)
+
+async def afetch_project_data(question: str, project_id: int) -> str:
+    """Asynchronous version of ~rag.project_tools.fetch_project_data. The queries are run outside the event loop.
+
+    Args:
+        question (str): The user query.
+        project_id (int): ID of the user's project.
+
+    Returns:
+        str: The project data needed to answer the question. Empty if no data is needed.
+    """
+    if project_data_mode == "prefix":
+        return await asyncio.to_thread(load_project_context, project_id)
+    message = await chain.ainvoke({"question": question})
+    logger.debug("Project data tools called", extra={"tools": [tool_call["name"] for tool_call in message.tool_calls]})
+    return await asyncio.to_thread(run_tool_calls, message.tool_calls, project_id)
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+
+from rag.clients import ollama_keep_alive
+
+import hashlib
+import math
+import threading
+import time
+
+
+class PromptPrefixTracker:
+    def __init__(self, max_size: int, ttl: float):
+        """Initialises a tracker of the prompt prefix last sent for each key, such as a project.
+
+        Ollama reuses the processed tokens of a prompt prefix it has seen while the model stays loaded.
+        A prefix counts as a hit when it is byte for byte the same as the previous prefix of the key, sent within the TTL.
+
+        Args:
+            max_size (int): Maximum number of tracked keys.
+            ttl (float): Seconds the model stays loaded after a request. math.inf if it stays loaded.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # Keys map to (prefix digest, time sent) -tuples, from the least to the most recently sent.
+        self._lock = threading.Lock()
+
+    def observe(self, key, prefix: str) -> bool:
+        """Records a prompt sent with a prefix.
+
+        Args:
+            key (_type_): The key the prefix belongs to.
+            prefix (str): The prefix.
+
+        Returns:
+            bool: Whether the prefix was a hit.
+        """
+        digest = hashlib.sha256(prefix.encode()).digest()
+        now = time.monotonic()
+        with self._lock:
+            previous = self._entries.get(key)
+            hit = previous is not None and previous[0] == digest and now - previous[1] <= self.ttl
+            self._entries[key] = (digest, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        prefix_requests.labels(result="hit" if hit else "miss").inc()
+        return hit
+
+
+prefix_requests = Counter(
+    "rag_prompt_prefix_requests_total",
+    "Prompts with a per-project prefix by whether the same prefix was sent on the project while the model stayed loaded.",
+    ["result"],
+)
+
+project_prefix_tracker = PromptPrefixTracker(max_size=1024, ttl=math.inf if ollama_keep_alive < 0 else ollama_keep_alive)
+
+prefix_hit_ratio = Gauge("rag_prompt_prefix_hit_ratio", "Share of prompts whose per-project prefix was a hit.")
+prefix_hit_ratio.set_function(lambda: project_prefix_tracker.hits / max(project_prefix_tracker.hits + project_prefix_tracker.misses, 1))
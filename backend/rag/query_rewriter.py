@@ -1,14 +1,9 @@
-from dotenv import load_dotenv
 from langchain.prompts import PromptTemplate
-from langchain_ollama import ChatOllama
 
-import os
+from rag.models import get_chat_model
 
 
-load_dotenv()
-model_name = os.environ["MODEL_NAME"]
-
-llm = ChatOllama(model=model_name, temperature=0)
+llm = get_chat_model(temperature=0, retry=True, lane="auxiliary")
 
 system_prompt = """You are a question re-writer that converts an input question to a better version that is optimized for vectorstore retrieval.
 Formulate an improved question based on the initial question below.
@@ -35,3 +30,15 @@ def rewrite_question(question: str) -> str:
     response = chain.invoke({"question": question})
     return response.content
 
+
+async def arewrite_question(question: str) -> str:
+    """Asynchronous version of ~rag.query_rewriter.rewrite_question.
+
+    Args:
+        question (str): The user question to rewrite.
+
+    Returns:
+        str: The retrieval optimised question.
+    """
+    response = await chain.ainvoke({"question": question})
+    return response.content
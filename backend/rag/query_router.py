@@ -1,15 +1,26 @@
-from dotenv import load_dotenv
 from langchain.prompts import ChatPromptTemplate
-from langchain_ollama import ChatOllama
 from langchain_core.output_parsers import JsonOutputParser
+from prometheus_client import Counter, Histogram
+from typing import List, Tuple
 
+from rag.clients import get_embedding_client
+from rag.models import get_chat_model
+
+import asyncio
+import logging
+import numpy as np
 import os
+import threading
+import time
 
 
-load_dotenv()
-model_name = os.environ["MODEL_NAME"]
+logger = logging.getLogger(__name__)
+# 'embedding' classifies questions locally and asks the LLM only when unsure, 'llm' always asks the LLM.
+router_mode = os.getenv("ROUTER_MODE", "embedding")
+# Minimum difference between the best and second best route similarity for the local classification to be used.
+router_margin = float(os.getenv("ROUTER_MARGIN", 0.03))
 
-llm = ChatOllama(model=model_name, format="json", temperature=0)
+llm = get_chat_model(json=True, temperature=0, retry=True, lane="auxiliary")
 
 system_prompt = """You are an expert at routing a user question to a vector database, project database, or general knowledge.
 You operate in a metrics monitoring tool designed for use in a software engineering project course.
@@ -28,15 +39,188 @@ prompt_template = ChatPromptTemplate.from_messages([
 
 chain = prompt_template | llm | JsonOutputParser()
 
+# Labelled example questions for the local router. Each route is represented by the centroid of its example embeddings.
+route_examples = {
+    "vector_database": [
+        "When is the final report due?",
+        "What are the deadlines for the course?",
+        "When is the next sprint review?",
+        "What should the weekly report contain?",
+        "How is the course graded?",
+        "Where can I find the project guidelines?",
+        "What are the requirements for the final presentation?",
+        "How many working hours are expected from each student on the course?",
+    ],
+    "project_database": [
+        "How is our project doing?",
+        "What could our project improve?",
+        "How many hours have we worked so far?",
+        "Is anyone in our team behind on their working hours?",
+        "What are the biggest risks in our project?",
+        "How have our metrics changed over the last weeks?",
+        "Are we on track to reach our target hours?",
+        "Summarise our project's status.",
+    ],
+    "general_knowledge": [
+        "What is a user story?",
+        "Explain the difference between Scrum and Kanban.",
+        "How do I write good unit tests?",
+        "What is continuous integration?",
+        "Give tips for running an effective retrospective.",
+        "What is technical debt?",
+        "How should requirements be collected in software engineering?",
+        "What is the purpose of a code review?",
+    ],
+}
 
-def route_question(question: str) -> str:
-    """Routes the question to a datasource which is required to answer the question.
+# Route names and the matrix of normalised route centroids. Computed on first use.
+route_names = list(route_examples)
+route_centroids = None
+route_centroids_lock = threading.Lock()
+
+routing_latency = Histogram(
+    "rag_routing_duration_seconds",
+    "Time spent routing one question.",
+    ["route", "method"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+# The fallback rate is the share of decisions with method 'llm' while ROUTER_MODE is 'embedding'.
+routing_decisions = Counter(
+    "rag_routing_decisions_total",
+    "Routing decisions by route and by the method which made the decision.",
+    ["route", "method"],
+)
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    """Scales vectors to unit length, so that dot products are cosine similarities.
+
+    Args:
+        vectors (np.ndarray): A vector or a matrix of row vectors.
+
+    Returns:
+        np.ndarray: The normalised vectors.
+    """
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def get_route_centroids() -> np.ndarray:
+    """Gets the normalised centroid of the example question embeddings for each route. Embeds the examples on first use.
+
+    Returns:
+        np.ndarray: A matrix with one centroid per route, in the order of route_names.
+    """
+    global route_centroids
+    with route_centroids_lock:
+        if route_centroids is None:
+            centroids = []
+            for route in route_names:
+                embeddings = normalise(np.array(get_embedding_client().embed_documents(route_examples[route])))
+                centroids.append(embeddings.mean(axis=0))
+            route_centroids = normalise(np.array(centroids))
+        return route_centroids
+
+def classify_embedding(question_embedding: List[float]) -> Tuple[str, float]:
+    """Classifies a question locally by the nearest route centroid to its embedding.
+
+    Args:
+        question_embedding (List[float]): The embedding of the user question.
+
+    Returns:
+        Tuple[str, float]: The closest route and the margin of its similarity over the second closest route.
+    """
+    centroids = get_route_centroids()
+    similarities = centroids @ normalise(np.array(question_embedding))
+    best, second = np.argsort(similarities)[::-1][:2]
+    return route_names[best], float(similarities[best] - similarities[second])
+
+def classify_question(question: str, question_embedding: List[float]=None) -> Tuple[str, float]:
+    """Classifies the question locally by its nearest route centroid.
+
+    Args:
+        question (str): The user question.
+        question_embedding (List[float], optional): The embedding of the question, if already computed. Defaults to None.
+
+    Returns:
+        Tuple[str, float]: The closest route and the margin of its similarity over the second closest route.
+    """
+    if question_embedding is None:
+        question_embedding = get_embedding_client().embed_query(question)
+    return classify_embedding(question_embedding)
+
+def route_question_with_llm(question: str) -> str:
+    """Routes the question by asking the LLM.
 
     Args:
         question (str): The user question.
 
     Returns:
-        str: A JSON string containing a key 'datasource' with the value of 'vector_database', 'project_database', or 'general_knowledge'.
+        str: The value of 'vector_database', 'project_database', or 'general_knowledge'.
     """
     result = chain.invoke({"question": question})
     return result.get("datasource")
+
+def record_routing(route: str, method: str, start_time: float) -> None:
+    """Records a routing decision into the routing metrics.
+
+    Args:
+        route (str): The chosen route.
+        method (str): 'embedding' or 'llm', whichever made the decision.
+        start_time (float): The time.perf_counter() value when routing started.
+    """
+    routing_decisions.labels(route=route, method=method).inc()
+    routing_latency.labels(route=route, method=method).observe(time.perf_counter() - start_time)
+
+def route_question(question: str, mode: str=router_mode, question_embedding: List[float]=None) -> str:
+    """Routes the question to a datasource which is required to answer the question.
+
+    In 'embedding' mode the question is classified by its similarity to example questions,
+    and the LLM is only used if the classification is not confident enough.
+
+    Args:
+        question (str): The user question.
+        mode (str, optional): 'embedding' or 'llm'. Defaults to ROUTER_MODE.
+        question_embedding (List[float], optional): The embedding of the question, if already computed. Defaults to None.
+
+    Returns:
+        str: The value of 'vector_database', 'project_database', or 'general_knowledge'.
+    """
+    start_time = time.perf_counter()
+    if mode == "embedding":
+        try:
+            route, margin = classify_question(question, question_embedding)
+            if margin >= router_margin:
+                record_routing(route, "embedding", start_time)
+                return route
+        except Exception as e: # The embedding model may be unavailable. The LLM router still works on its own.
+            logger.warning("Local classification failed, using the LLM", extra={"error": str(e)})
+    route = route_question_with_llm(question)
+    record_routing(route, "llm", start_time)
+    return route
+
+async def aroute_question(question: str, mode: str=router_mode, question_embedding: List[float]=None) -> str:
+    """Asynchronous version of ~rag.query_router.route_question.
+
+    Args:
+        question (str): The user question.
+        mode (str, optional): 'embedding' or 'llm'. Defaults to ROUTER_MODE.
+        question_embedding (List[float], optional): The embedding of the question, if already computed. Defaults to None.
+
+    Returns:
+        str: The value of 'vector_database', 'project_database', or 'general_knowledge'.
+    """
+    start_time = time.perf_counter()
+    if mode == "embedding":
+        try:
+            await asyncio.to_thread(get_route_centroids) # Embeds the examples outside the event loop on first use.
+            if question_embedding is None:
+                question_embedding = await get_embedding_client().aembed_query(question)
+            route, margin = classify_embedding(question_embedding)
+            if margin >= router_margin:
+                record_routing(route, "embedding", start_time)
+                return route
+        except Exception as e:
+            logger.warning("Local classification failed, using the LLM", extra={"error": str(e)})
+    result = await chain.ainvoke({"question": question})
+    route = result.get("datasource")
+    record_routing(route, "llm", start_time)
+    return route
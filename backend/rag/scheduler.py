@@ -0,0 +1,315 @@
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+
+load_dotenv()
+
+
+class QueueFullError(Exception):
+    def __init__(self, lane: str, retry_after: int):
+        """Raised when a request is rejected because the queue of its lane is full.
+
+        Args:
+            lane (str): Name of the lane.
+            retry_after (int): Estimated seconds until the request could be admitted.
+        """
+        super().__init__(f"The queue of the {lane} lane is full.")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class QueuePosition(int):
+    """A queue position yielded by an answer stream while it waits for a generation slot, in between the parts of the answer."""
+
+
+class Lane:
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        """Holds the state of one scheduling lane.
+
+        Args:
+            name (str): Name of the lane.
+            concurrency (int): Maximum number of admitted requests at the same time.
+            max_queue (int): Maximum number of requests waiting for admission.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queue = [] # Heap of (priority, sequence number, ticket) -tuples.
+        self.reserved = 0 # Accepted requests which have not entered the queue yet. See ~rag.scheduler.Scheduler.reserve.
+        self.average_duration = 10.0 # Moving average of seconds between admission and release. Used for Retry-After.
+
+
+class Ticket:
+    def __init__(self, scheduler, lane: Lane, priority: int, sequence: int):
+        """A request submitted to the scheduler. Either admitted or waiting in the queue of its lane.
+
+        Args:
+            scheduler (Scheduler): The scheduler the ticket belongs to.
+            lane (Lane): The lane the ticket was submitted to.
+            priority (int): Lower values are admitted first.
+            sequence (int): Submission order, for FIFO order within a priority.
+        """
+        self.scheduler = scheduler
+        self.lane = lane
+        self.priority = priority
+        self.sequence = sequence
+        self.admitted_at = None
+        self.released = False
+        self.reserved = False
+        self._event = threading.Event()
+        self._loop = None
+        self._future = None
+
+    def _admit(self) -> None:
+        self.admitted_at = time.monotonic()
+        self._event.set()
+        if self._future is not None:
+            self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(None))
+
+    @property
+    def admitted(self) -> bool:
+        return self._event.is_set()
+
+    def position(self) -> int:
+        """Gets the position of the ticket in its queue.
+
+        Returns:
+            int: 1 for the next ticket to be admitted. 0 if the ticket has been admitted.
+        """
+        return self.scheduler.position(self)
+
+    def wait(self, poll_interval: float=1.0) -> Iterator[int]:
+        """Waits for admission, yielding the queue position whenever it changes.
+
+        Args:
+            poll_interval (float, optional): Seconds between queue position checks. Defaults to 1.0.
+
+        Yields:
+            Iterator[int]: The current queue position.
+        """
+        self.scheduler.enter(self)
+        last_position = None
+        timeout = 0 # The first position is reported without delay.
+        while not self._event.wait(timeout=timeout):
+            timeout = poll_interval
+            position = self.position()
+            if position and position != last_position:
+                last_position = position
+                yield position
+
+    async def await_admission(self, poll_interval: float=1.0) -> AsyncIterator[int]:
+        """Asynchronous version of ~rag.scheduler.Ticket.wait. Does not hold a thread while waiting.
+
+        Args:
+            poll_interval (float, optional): Seconds between queue position checks. Defaults to 1.0.
+
+        Yields:
+            AsyncIterator[int]: The current queue position.
+        """
+        self.scheduler.enter(self)
+        with self.scheduler.lock:
+            if self.admitted:
+                return
+            self._loop = asyncio.get_running_loop()
+            self._future = self._loop.create_future()
+        last_position = None
+        while not self.admitted:
+            position = self.position()
+            if position and position != last_position:
+                last_position = position
+                yield position
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self) -> None:
+        """Frees the slot of an admitted ticket, or removes a waiting ticket from the queue. Safe to call more than once."""
+        self.scheduler.release(self)
+
+
+class Scheduler:
+    def __init__(self, lanes: dict):
+        """Initialises an admission scheduler in front of the model.
+
+        Each lane has its own concurrency limit and bounded priority queue, so that short auxiliary calls
+        do not wait behind long generations.
+
+        Args:
+            lanes (dict): Keys are lane names, values are (concurrency, max queue length) -tuples.
+        """
+        self.lanes = {name: Lane(name, concurrency, max_queue) for name, (concurrency, max_queue) in lanes.items()}
+        self.lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def submit(self, lane_name: str, priority: int=0) -> Ticket:
+        """Submits a request. The returned ticket is admitted immediately if the lane has a free slot.
+
+        Args:
+            lane_name (str): Name of the lane.
+            priority (int, optional): Lower values are admitted first. Defaults to 0.
+
+        Raises:
+            QueueFullError: If the queue of the lane is full.
+
+        Returns:
+            Ticket: The ticket of the request. Must be released when the request finishes.
+        """
+        lane = self.lanes[lane_name]
+        with self.lock:
+            if (lane.active >= lane.concurrency or lane.queue) and len(lane.queue) >= lane.max_queue:
+                scheduler_rejections.labels(lane=lane.name).inc()
+                raise QueueFullError(lane.name, self._estimate_wait(lane))
+            ticket = Ticket(self, lane, priority, next(self._sequence))
+            self._enqueue(ticket)
+        return ticket
+
+    def reserve(self, lane_name: str, priority: int=0) -> Ticket:
+        """Accepts a request which needs a slot only later, e.g. after the stages preceding the generation.
+
+        The ticket counts against the capacity of the lane, so that a full lane rejects requests up front,
+        but holds no slot and has no place in the queue until it enters the queue when waited for.
+
+        Args:
+            lane_name (str): Name of the lane.
+            priority (int, optional): Lower values are admitted first. Defaults to 0.
+
+        Raises:
+            QueueFullError: If the admitted, queued and reserved requests of the lane fill its slots and queue.
+
+        Returns:
+            Ticket: The reserved ticket. Must be released when the request finishes.
+        """
+        lane = self.lanes[lane_name]
+        with self.lock:
+            if lane.active + len(lane.queue) + lane.reserved >= lane.concurrency + lane.max_queue:
+                scheduler_rejections.labels(lane=lane.name).inc()
+                raise QueueFullError(lane.name, self._estimate_wait(lane))
+            ticket = Ticket(self, lane, priority, next(self._sequence))
+            ticket.reserved = True
+            lane.reserved += 1
+        return ticket
+
+    def enter(self, ticket: Ticket) -> None:
+        """Moves a reserved ticket into the queue of its lane, or admits it if a slot is free. Does nothing for other tickets.
+
+        Args:
+            ticket (Ticket): The ticket.
+        """
+        with self.lock:
+            if not ticket.reserved or ticket.released:
+                return
+            ticket.reserved = False
+            ticket.lane.reserved -= 1
+            self._enqueue(ticket)
+
+    def _enqueue(self, ticket: Ticket) -> None:
+        lane = ticket.lane
+        if lane.active < lane.concurrency and not lane.queue:
+            lane.active += 1
+            ticket._admit()
+        else:
+            heapq.heappush(lane.queue, (ticket.priority, ticket.sequence, ticket))
+
+    def position(self, ticket: Ticket) -> int:
+        """Gets the position of a ticket in its queue.
+
+        Args:
+            ticket (Ticket): The ticket.
+
+        Returns:
+            int: 1 for the next ticket to be admitted. 0 if the ticket is not queued.
+        """
+        with self.lock:
+            if ticket.admitted or ticket.released or ticket.reserved:
+                return 0
+            key = (ticket.priority, ticket.sequence)
+            return 1 + sum(1 for priority, sequence, _ in ticket.lane.queue if (priority, sequence) < key)
+
+    def release(self, ticket: Ticket) -> None:
+        """Frees the slot of an admitted ticket and admits the next queued one, or removes a waiting ticket from the queue.
+
+        Args:
+            ticket (Ticket): The ticket to release.
+        """
+        lane = ticket.lane
+        with self.lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.reserved:
+                lane.reserved -= 1
+                return
+            if not ticket.admitted:
+                lane.queue = [entry for entry in lane.queue if entry[2] is not ticket]
+                heapq.heapify(lane.queue)
+                return
+            duration = time.monotonic() - ticket.admitted_at
+            lane.average_duration = 0.9 * lane.average_duration + 0.1 * duration
+            lane.active -= 1
+            while lane.queue and lane.active < lane.concurrency:
+                _, _, next_ticket = heapq.heappop(lane.queue)
+                lane.active += 1
+                next_ticket._admit()
+
+    def _estimate_wait(self, lane: Lane) -> int:
+        return max(1, math.ceil((len(lane.queue) + 1) * lane.average_duration / lane.concurrency))
+
+    @contextmanager
+    def slot(self, lane_name: str, priority: int=0):
+        """Context manager holding a slot in a lane. Blocks until admitted.
+
+        Args:
+            lane_name (str): Name of the lane.
+            priority (int, optional): Lower values are admitted first. Defaults to 0.
+        """
+        ticket = self.submit(lane_name, priority)
+        try:
+            for _ in ticket.wait():
+                pass
+            yield ticket
+        finally:
+            ticket.release()
+
+    @asynccontextmanager
+    async def aslot(self, lane_name: str, priority: int=0):
+        """Asynchronous version of ~rag.scheduler.Scheduler.slot.
+
+        Args:
+            lane_name (str): Name of the lane.
+            priority (int, optional): Lower values are admitted first. Defaults to 0.
+        """
+        ticket = self.submit(lane_name, priority)
+        try:
+            async for _ in ticket.await_admission():
+                pass
+            yield ticket
+        finally:
+            ticket.release()
+
+
+# 'generation' admits chat requests, 'auxiliary' admits the router, grader, and rewriter calls.
+scheduler = Scheduler({
+    "generation": (int(os.getenv("SCHEDULER_GENERATION_CONCURRENCY", 2)), int(os.getenv("SCHEDULER_GENERATION_QUEUE", 32))),
+    "auxiliary": (int(os.getenv("SCHEDULER_AUXILIARY_CONCURRENCY", 4)), int(os.getenv("SCHEDULER_AUXILIARY_QUEUE", 256))),
+})
+
+scheduler_rejections = Counter("scheduler_rejections_total", "Requests rejected because the queue was full.", ["lane"])
+scheduler_active = Gauge("scheduler_active", "Admitted requests by lane.", ["lane"])
+scheduler_queued = Gauge("scheduler_queued", "Requests waiting for admission by lane.", ["lane"])
+scheduler_reserved = Gauge("scheduler_reserved", "Accepted requests which have not asked for a slot yet by lane.", ["lane"])
+for lane in scheduler.lanes.values():
+    scheduler_active.labels(lane=lane.name).set_function(lambda lane=lane: lane.active)
+    scheduler_queued.labels(lane=lane.name).set_function(lambda lane=lane: len(lane.queue))
+    scheduler_reserved.labels(lane=lane.name).set_function(lambda lane=lane: lane.reserved)
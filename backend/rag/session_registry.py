@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+from prometheus_client import Gauge
+
+import logging
+import os
+import sys
+import threading
+import time
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    def __init__(self):
+        """Holds everything kept in memory for one front-end session.
+
+        history: The BaseChatMessageHistory of the session. Created on the first chat request.
+        last_seen: Monotonic timestamp of the latest request in the session.
+        """
+        self.history = None
+        self.last_seen = time.monotonic()
+
+    def approximate_bytes(self) -> int:
+        """Estimates the memory held by the message history of the session.
+
+        Returns:
+            int: The approximate size of the message contents in bytes.
+        """
+        if self.history is None:
+            return 0
+        return sum(sys.getsizeof(message.content) for message in self.history.messages)
+
+
+class SessionRegistry:
+    def __init__(self, idle_ttl: float, max_sessions: int, sweep_interval: float):
+        """Initialises a registry of sessions with idle expiry and a least recently used size bound.
+
+        Evicting a session drops its timestamp and message history together.
+
+        Args:
+            idle_ttl (float): Seconds of inactivity after which a session is evicted.
+            max_sessions (int): Maximum number of sessions held. The least recently seen session is evicted first.
+            sweep_interval (float): Seconds between sweeps for idle sessions.
+        """
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict() # Ordered from the least to the most recently seen session.
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def touch(self, session_id: str) -> Session:
+        """Gets a session and updates its last seen timestamp. Creates the session if it does not exist.
+
+        Args:
+            session_id (str): ID of the session.
+
+        Returns:
+            Session: The session.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session()
+                while len(self._sessions) > self.max_sessions:
+                    evicted_id, _ = self._sessions.popitem(last=False)
+                    logger.debug("Evicted least recently used session", extra={"session_id": evicted_id})
+            session.last_seen = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def evict(self, session_id: str) -> None:
+        """Removes a session and everything held for it.
+
+        Args:
+            session_id (str): ID of the session.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def sweep(self) -> int:
+        """Evicts all sessions which have been idle longer than the idle TTL.
+
+        Returns:
+            int: The number of evicted sessions.
+        """
+        deadline = time.monotonic() - self.idle_ttl
+        evicted = 0
+        with self._lock:
+            # Sessions are ordered by last seen, so the idle ones are at the start.
+            while self._sessions:
+                session_id, session = next(iter(self._sessions.items()))
+                if session.last_seen > deadline:
+                    break
+                del self._sessions[session_id]
+                evicted += 1
+        if evicted:
+            logger.debug("Evicted idle sessions", extra={"evicted": evicted})
+        return evicted
+
+    def sweep_periodically(self) -> None:
+        """Sweeps idle sessions in a loop. Meant to be run in a background thread."""
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def start_sweeper(self) -> None:
+        """Starts sweeping idle sessions in a background thread. Does nothing if the sweeper is already running."""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self.sweep_periodically, name="session_sweeper", daemon=True)
+            self._sweeper.start()
+
+    def approximate_bytes(self) -> int:
+        """Estimates the memory held by the message histories of all sessions.
+
+        Returns:
+            int: The approximate size of the message contents in bytes.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(session.approximate_bytes() for session in sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+session_registry = SessionRegistry(
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 1800)),
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", 1000)),
+    sweep_interval=float(os.getenv("SESSION_SWEEP_INTERVAL", 60)),
+)
+
+live_sessions = Gauge("rag_live_sessions", "Number of sessions held in memory.")
+live_sessions.set_function(lambda: len(session_registry))
+session_bytes = Gauge("rag_session_bytes", "Approximate size of the message histories held in memory, in bytes.")
+session_bytes.set_function(session_registry.approximate_bytes)
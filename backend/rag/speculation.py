@@ -0,0 +1,145 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge
+from typing import Dict, List
+
+from rag.document_manager import aretrieve_documents, retrieve_documents
+from rag.project_tools import afetch_project_data, fetch_project_data
+
+import asyncio
+import os
+import threading
+
+
+load_dotenv()
+# Starts retrieval concurrently with routing, so that RAG answers do not wait for the router.
+speculative_retrieval = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# Also starts the project data fetch concurrently with routing. Costs a tool selection call on every question with a project.
+speculative_project_data = os.getenv("SPECULATIVE_PROJECT_DATA", "false").lower() == "true"
+
+speculation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATION_WORKERS", 8)),
+    thread_name_prefix="speculation",
+)
+
+speculative_tasks = Counter(
+    "rag_speculative_tasks_total",
+    "Speculatively started stages by route and whether the route used them.",
+    ["route", "outcome"],
+)
+
+# Running totals for the wasted work ratio gauge.
+speculation_outcomes = {"used": 0, "wasted": 0}
+speculation_lock = threading.Lock()
+
+wasted_work_ratio = Gauge("rag_speculative_wasted_ratio", "Share of speculatively started stages whose results were discarded.")
+wasted_work_ratio.set_function(lambda: speculation_outcomes["wasted"] / max(sum(speculation_outcomes.values()), 1))
+
+
+def record_speculation(route: str, outcome: str) -> None:
+    """Records whether a speculatively started stage was used.
+
+    Args:
+        route (str): The route the stage belongs to.
+        outcome (str): 'used' or 'wasted'.
+    """
+    speculative_tasks.labels(route=route, outcome=outcome).inc()
+    with speculation_lock:
+        speculation_outcomes[outcome] += 1
+
+def start_speculation(question: str, question_embedding: List[float], project_id: int) -> Dict[str, Future]:
+    """Starts the retrieval stages of the routes in background threads, before the route is known.
+
+    Args:
+        question (str): The user query.
+        question_embedding (List[float]): The embedding of the user query. Embedded by the retrieval if None.
+        project_id (int): The ID associated with the user's project.
+
+    Returns:
+        Dict[str, Future]: The started stages by route.
+    """
+    speculative = {}
+    if speculative_retrieval:
+        speculative["vector_database"] = speculation_executor.submit(retrieve_documents, question, query_embedding=question_embedding)
+    if speculative_project_data and project_id:
+        speculative["project_database"] = speculation_executor.submit(fetch_project_data, question, project_id)
+    return speculative
+
+def astart_speculation(question: str, question_embedding: List[float], project_id: int) -> Dict[str, asyncio.Task]:
+    """Asynchronous version of ~rag.speculation.start_speculation. The stages are started as tasks in the running event loop.
+
+    Args:
+        question (str): The user query.
+        question_embedding (List[float]): The embedding of the user query. Embedded by the retrieval if None.
+        project_id (int): The ID associated with the user's project.
+
+    Returns:
+        Dict[str, asyncio.Task]: The started stages by route.
+    """
+    speculative = {}
+    if speculative_retrieval:
+        speculative["vector_database"] = asyncio.create_task(aretrieve_documents(question, query_embedding=question_embedding))
+    if speculative_project_data and project_id:
+        speculative["project_database"] = asyncio.create_task(afetch_project_data(question, project_id))
+    return speculative
+
+def select_speculation(speculative: dict, route: str):
+    """Keeps the stage started for the chosen route and discards the others.
+
+    Args:
+        speculative (dict): The started stages by route. Futures or tasks.
+        route (str): The chosen route.
+
+    Returns:
+        Future | asyncio.Task: The stage of the chosen route. None if it was not started.
+    """
+    selected = speculative.pop(route, None)
+    for other_route, stage in speculative.items():
+        discard_speculation(other_route, stage)
+    return selected
+
+def ignore_result(stage) -> None:
+    """Retrieves the exception of a discarded stage, so that asyncio does not log a task which failed instead of being cancelled as never retrieved.
+
+    Args:
+        stage (Future | asyncio.Task): The finished stage.
+    """
+    if not stage.cancelled():
+        stage.exception()
+
+def discard_speculation(route: str, stage) -> None:
+    """Cancels a speculatively started stage. A stage which is already running finishes, and its result or error is ignored.
+
+    Args:
+        route (str): The route the stage belongs to.
+        stage (Future | asyncio.Task): The stage.
+    """
+    stage.cancel()
+    stage.add_done_callback(ignore_result)
+    record_speculation(route, "wasted")
+
+def use_speculation(route: str, stage: Future):
+    """Waits for the result of a speculatively started stage.
+
+    Args:
+        route (str): The route the stage belongs to.
+        stage (Future): The stage.
+
+    Returns:
+        _type_: The result of the stage.
+    """
+    record_speculation(route, "used")
+    return stage.result()
+
+async def ause_speculation(route: str, stage: asyncio.Task):
+    """Asynchronous version of ~rag.speculation.use_speculation.
+
+    Args:
+        route (str): The route the stage belongs to.
+        stage (asyncio.Task): The stage.
+
+    Returns:
+        _type_: The result of the stage.
+    """
+    record_speculation(route, "used")
+    return await stage
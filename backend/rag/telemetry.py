@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from prometheus_client import Counter, Histogram
+
+from rag.tokens import count_tokens
+
+import json
+import logging
+import os
+import time
+
+
+load_dotenv()
+log_level = os.getenv("LOG_LEVEL", "INFO")
+# 'json' writes one JSON object per line, 'text' writes plain lines for reading in a terminal.
+log_format = os.getenv("LOG_FORMAT", "json")
+
+logger = logging.getLogger(__name__)
+
+stage_duration = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each stage of the RAG pipeline.",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+time_to_first_token = Histogram(
+    "rag_time_to_first_token_seconds",
+    "Time from receiving a question to the first streamed piece of the answer, by route.",
+    ["route"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60),
+)
+generation_speed = Histogram(
+    "rag_generation_tokens_per_second",
+    "Generated tokens per second after the first token, by route.",
+    ["route"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 150, 200),
+)
+# Ollama reports only the prompt tokens it had to process, so prompts sharing a cached prefix report fewer tokens.
+evaluated_prompt_tokens = Histogram(
+    "rag_prompt_evaluated_tokens",
+    "Prompt tokens processed by the model for an answer, excluding a reused prefix, by route.",
+    ["route"],
+    buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+chat_requests = Counter("rag_chat_requests_total", "Answered questions by route.", ["route"])
+
+# Attributes of every LogRecord. Anything else on a record was passed in 'extra' and is written as a field.
+standard_record_attributes = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single-line JSON objects, including the fields passed in 'extra'."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload.update({key: value for key, value in vars(record).items() if key not in standard_record_attributes})
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class GenerationTimer:
+    def __init__(self, route: str, start_time: float):
+        """Measures time-to-first-token and generation speed of one answer.
+
+        Args:
+            route (str): The route of the question. Used as the metric label.
+            start_time (float): The time.perf_counter() value when the question was received.
+        """
+        self.route = route
+        self.start_time = start_time
+        self.first_token_time = None
+        self.output_tokens = None
+        self.prompt_tokens = None
+
+    def chunk(self, chunk) -> None:
+        """Records a streamed piece of the answer.
+
+        Args:
+            chunk (BaseMessageChunk | str): The piece. Token usage reported by the model is taken from message chunks.
+        """
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+            time_to_first_token.labels(route=self.route).observe(self.first_token_time - self.start_time)
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.output_tokens = usage.get("output_tokens")
+            self.prompt_tokens = usage.get("input_tokens")
+
+    def finish(self, answer: str) -> None:
+        """Records the end of the answer.
+
+        Args:
+            answer (str): The whole answer. Its tokens are counted if the model did not report them.
+        """
+        chat_requests.labels(route=self.route).inc()
+        if self.prompt_tokens is not None:
+            evaluated_prompt_tokens.labels(route=self.route).observe(self.prompt_tokens)
+        if self.first_token_time is None:
+            return
+        elapsed = time.perf_counter() - self.first_token_time
+        tokens = self.output_tokens if self.output_tokens else count_tokens(answer)
+        if elapsed > 0:
+            generation_speed.labels(route=self.route).observe(tokens / elapsed)
+        logger.info("Answer generated", extra={
+            "route": self.route,
+            "ttft": round(self.first_token_time - self.start_time, 4),
+            "duration": round(time.perf_counter() - self.start_time, 4),
+            "tokens": tokens,
+            "prompt_tokens": self.prompt_tokens,
+        })
+
+
+def configure_logging(level: str=log_level, format: str=log_format) -> None:
+    """Configures the root logger to write to standard error.
+
+    Args:
+        level (str, optional): The minimum level of logged records. Defaults to LOG_LEVEL.
+        format (str, optional): 'json' or 'text'. Defaults to LOG_FORMAT.
+    """
+    handler = logging.StreamHandler()
+    if format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+@contextmanager
+def span(stage: str, **fields):
+    """Times a stage of the pipeline into the stage duration histogram and the log. Works in synchronous and asynchronous code.
+
+    Args:
+        stage (str): Name of the stage.
+        **fields: Additional fields for the log record.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        stage_duration.labels(stage=stage).observe(duration)
+        logger.debug("Stage finished", extra={"stage": stage, "duration": round(duration, 4), **fields})
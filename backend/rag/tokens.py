@@ -0,0 +1,21 @@
+from dotenv import load_dotenv
+
+import math
+import os
+
+
+load_dotenv()
+# Tokens are estimated from the text length, since the tokenizers of Ollama models are not available locally.
+chars_per_token = float(os.getenv("TOKEN_CHARS_PER_TOKEN", 4.0))
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of tokens in a text from its length.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return math.ceil(len(text) / chars_per_token)
@@ -0,0 +1,200 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from prometheus_client import Gauge
+from typing import Callable, Dict, List
+
+from database.sql_executor import get_database
+from rag.clients import get_chat_client, get_embedding_client, lazy_import
+from rag.document_manager import get_collection, get_keyword_index, retrieval_mode
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+warmup_enabled = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+# Number of the most recently active projects whose data is loaded into the project data cache at startup.
+warmup_projects = int(os.getenv("WARMUP_PROJECTS", 8))
+# Seconds between attempts of a failed required warm-up step, e.g. while Ollama is still starting.
+warmup_retry_interval = float(os.getenv("WARMUP_RETRY_INTERVAL", 10))
+recent_projects_path = os.getenv("RECENT_PROJECTS_PATH", "./recent_projects.json")
+
+
+class RecentProjects:
+    def __init__(self, path: str, max_size: int, save_interval: float):
+        """Initialises a record of the projects chatted about, persisted so that the next process can warm them up.
+        The record is saved in a background thread, so that recording activity does not wait for the file system.
+
+        Args:
+            path (str): Path to the JSON file the record is saved in.
+            max_size (int): Maximum number of projects recorded. The least recently active project is dropped first.
+            save_interval (float): Minimum seconds between saves, unless a project is recorded for the first time.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.save_interval = save_interval
+        self._projects = OrderedDict() # Keys are project IDs, ordered from the least to the most recently active project.
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recent_projects")
+        try:
+            with open(path, "r") as f:
+                self._projects.update((int(project_id), None) for project_id in json.load(f)[-max_size:])
+        except (FileNotFoundError, json.JSONDecodeError, TypeError, ValueError):
+            pass
+
+    def touch(self, project_id: int) -> None:
+        """Records activity on a project.
+
+        Args:
+            project_id (int): ID of the project.
+        """
+        with self._lock:
+            new = project_id not in self._projects
+            self._projects[project_id] = None
+            self._projects.move_to_end(project_id)
+            while len(self._projects) > self.max_size:
+                self._projects.popitem(last=False)
+            if not new and time.monotonic() - self._saved_at < self.save_interval:
+                return
+            self._saved_at = time.monotonic()
+        self._saver.submit(self.save)
+
+    def save(self) -> None:
+        """Saves the record to its file."""
+        with self._lock:
+            projects = list(self._projects)
+        try:
+            with open(self.path, "w") as f:
+                json.dump(projects, f)
+        except OSError as e:
+            logger.warning("Could not save recent projects", extra={"error": str(e)})
+
+    def most_recent(self, n: int) -> List:
+        """Gets the most recently active projects.
+
+        Args:
+            n (int): Maximum number of projects.
+
+        Returns:
+            List: The project IDs, from the most to the least recently active project.
+        """
+        with self._lock:
+            return list(reversed(self._projects))[:n]
+
+
+class Warmup:
+    def __init__(self, steps: Dict[str, Callable[[], None]], required: List[str], retry_interval: float):
+        """Initialises the warm-up run at startup, and the readiness derived from it.
+
+        The steps run concurrently. Failed required steps are retried until they succeed, failed optional steps are not.
+        The backend is ready once every step has finished and the required steps have succeeded.
+
+        Args:
+            steps (Dict[str, Callable[[], None]]): Keys are step names, values are functions raising on failure.
+            required (List[str]): Names of the steps without which requests would fail.
+            retry_interval (float): Seconds between attempts of a failed required step.
+        """
+        self.steps = steps
+        self.required = required
+        self.retry_interval = retry_interval
+        self.status = {name: "pending" for name in steps} # Values are 'pending', 'ready', or 'failed'.
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run_step(self, name: str) -> None:
+        """Runs a step until it succeeds, or once if it is optional.
+
+        Args:
+            name (str): Name of the step.
+        """
+        while True:
+            start_time = time.perf_counter()
+            try:
+                self.steps[name]()
+                self.status[name] = "ready"
+                logger.info("Warm-up step finished", extra={"step": name, "duration": round(time.perf_counter() - start_time, 4)})
+                return
+            except Exception as e:
+                self.status[name] = "failed"
+                logger.warning("Warm-up step failed", extra={"step": name, "error": str(e), "required": name in self.required})
+                if name not in self.required:
+                    return
+            time.sleep(self.retry_interval)
+
+    def run(self) -> None:
+        """Runs all steps concurrently and waits for them to finish."""
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.steps), thread_name_prefix="warmup") as executor:
+            list(executor.map(self.run_step, self.steps))
+        logger.info("Warm-up finished", extra={"duration": round(time.perf_counter() - start_time, 4), "steps": self.status})
+
+    def start(self) -> None:
+        """Starts the warm-up in a background thread. Does nothing if it has already been started."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def is_ready(self) -> bool:
+        """Checks whether the first requests will be served without loading anything.
+
+        Returns:
+            bool: Whether the warm-up has finished and the required steps have succeeded.
+        """
+        if not warmup_enabled:
+            return True
+        return "pending" not in self.status.values() and all(self.status[name] == "ready" for name in self.required)
+
+
+def load_pipeline() -> None:
+    """Imports the answer pipeline, which imports LangChain and builds the chains of every stage."""
+    lazy_import("rag.llm")
+
+def load_chat_model() -> None:
+    """Loads the chat model in Ollama with a request generating a single token."""
+    get_chat_client().invoke("Hi", options={"num_predict": 1})
+
+def load_retrieval() -> None:
+    """Loads the embedding model in Ollama, the vector index of the vectorstore, and the keyword index."""
+    embedding = get_embedding_client().embed_documents(["Hi"])[0]
+    if get_collection().count():
+        get_collection().query(query_embeddings=[embedding], n_results=1)
+    if retrieval_mode == "hybrid":
+        get_keyword_index()
+
+def load_project_data() -> None:
+    """Opens the database connection pool, and loads the data of the most recently active projects into the project data cache."""
+    load_project_context = lazy_import("rag.project_tools").load_project_context
+    with get_database().checkout() as connection:
+        if connection is None:
+            raise ConnectionError("Could not connect to the MMT database.")
+    projects = recent_projects.most_recent(warmup_projects)
+    for project_id in projects:
+        load_project_context(project_id)
+    logger.debug("Loaded recent project data", extra={"projects": projects})
+
+
+recent_projects = RecentProjects(recent_projects_path, max_size=max(warmup_projects, 1), save_interval=60)
+
+# The database is optional, since questions about the course pages and general questions work without it.
+warmup = Warmup(
+    steps={"pipeline": load_pipeline, "chat_model": load_chat_model, "retrieval": load_retrieval, "project_data": load_project_data},
+    required=["pipeline", "chat_model", "retrieval"],
+    retry_interval=warmup_retry_interval,
+)
+
+ready = Gauge("rag_ready", "Whether the backend has warmed up and is ready for traffic.")
+ready.set_function(warmup.is_ready)
+
+
+def start_warmup() -> None:
+    """Starts warming up the models, the vectorstore and the database in the background, unless WARMUP_ENABLED is false."""
+    if warmup_enabled:
+        warmup.start()
@@ -0,0 +1,7 @@
+import os
+
+
+# Placeholders for the variables required at import, unless set. Nothing connects anywhere in the tests.
+for name, value in {"MODEL_NAME": "unused", "EMBEDDING_MODEL_NAME": "unused", "JWT_ALGORITHM": "HS256", "JWT_SECRET_KEY": "unused"}.items():
+    os.environ.setdefault(name, value)
+os.environ.setdefault("WARMUP_ENABLED", "false") # The apps start the warm-up on their first request.
@@ -0,0 +1,51 @@
+from rag.answer_cache import SemanticAnswerCache
+
+
+def test_similar_question_hits():
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put([1.0, 0.0], version=1, prompt="What is Scrum?", answer="A framework.")
+
+    assert cache.get([0.99, 0.01], version=1) == ("What is Scrum?", "A framework.")
+    assert cache.get([0.0, 1.0], version=1) is None
+
+def test_new_version_drops_entries():
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put([1.0, 0.0], version=1, prompt="What is Scrum?", answer="A framework.")
+
+    assert cache.get([1.0, 0.0], version=2) is None
+    assert len(cache) == 0
+
+def test_stale_put_keeps_newer_entries():
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put([1.0, 0.0], version=2, prompt="What is Scrum?", answer="A framework.")
+    # An answer generated before the vectorstore changed finishes after a newer one was cached.
+    cache.put([0.0, 1.0], version=1, prompt="What is Kanban?", answer="A method.")
+
+    assert cache.version == 2
+    assert len(cache) == 1
+    assert cache.get([0.0, 1.0], version=1) is None
+    assert cache.get([1.0, 0.0], version=2) == ("What is Scrum?", "A framework.")
+
+def test_least_recently_used_is_evicted():
+    cache = SemanticAnswerCache(max_size=2, ttl=60, threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], version=1, prompt="a", answer="A")
+    cache.put([0.0, 1.0, 0.0], version=1, prompt="b", answer="B")
+    cache.get([1.0, 0.0, 0.0], version=1)
+    cache.put([0.0, 0.0, 1.0], version=1, prompt="c", answer="C")
+
+    assert cache.get([0.0, 1.0, 0.0], version=1) is None
+    assert cache.get([1.0, 0.0, 0.0], version=1) == ("a", "A")
+
+def test_empty_answer_is_not_cached():
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put([1.0, 0.0], version=1, prompt="What is Scrum?", answer=" \n")
+
+    assert len(cache) == 0
+
+def test_zero_embedding_is_ignored():
+    cache = SemanticAnswerCache(max_size=4, ttl=60, threshold=0.95)
+    cache.put([0.0, 0.0], version=1, prompt="", answer="A framework.")
+    assert len(cache) == 0
+
+    cache.put([1.0, 0.0], version=1, prompt="What is Scrum?", answer="A framework.")
+    assert cache.get([0.0, 0.0], version=1) is None
@@ -0,0 +1,38 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag import chat_history
+from rag.chat_history import ChatHistoryStore
+from rag.session_registry import session_registry
+
+import time
+
+
+def test_load_window_keeps_system_messages(tmp_path):
+    store = ChatHistoryStore(str(tmp_path / "history.db"))
+    store.append("s1", [SystemMessage("system")] + [HumanMessage(str(i)) for i in range(5)])
+
+    assert [m.content for m in store.load_window("s1", 2)] == ["system", "3", "4"]
+
+def test_delete_inactive_deletes_only_expired_sessions(tmp_path):
+    store = ChatHistoryStore(str(tmp_path / "history.db"))
+    store.append("old", [HumanMessage("Hi"), AIMessage("Hello")])
+    cutoff = time.time()
+    store.append("new", [HumanMessage("Hi")])
+
+    assert store.delete_inactive(cutoff) == ["old"]
+    assert store.load_window("old", 10) == []
+    assert [m.content for m in store.load_window("new", 10)] == ["Hi"]
+
+def test_purge_evicts_session_and_deletes_memory(tmp_path, monkeypatch):
+    store = ChatHistoryStore(str(tmp_path / "history.db"))
+    store.append("expired", [HumanMessage("Hi")])
+    deleted_memories = []
+    monkeypatch.setattr(chat_history, "history_store", store)
+    monkeypatch.setattr(chat_history, "delete_memory", deleted_memories.append)
+    session_registry.touch("expired")
+
+    assert chat_history.purge_expired_histories(retention=-1) == 1
+    chat_history.memory_executor.submit(lambda: None).result() # Waits for the deletions queued before.
+    assert "expired" not in session_registry
+    assert deleted_memories == ["expired"]
+    assert chat_history.purge_expired_histories(retention=-1) == 0
@@ -0,0 +1,10 @@
+from benchmarks.import_time import check_budget, measure_import
+
+import pytest
+
+
+@pytest.mark.parametrize("module", ["api", "asgi", "main"])
+def test_entry_module_imports_within_budget(module):
+    # Each module is imported in a fresh interpreter, so that modules imported by other tests do not hide its imports.
+    result = measure_import(module, repeat=3)
+    assert check_budget({module: result}, budget=0.75) == []
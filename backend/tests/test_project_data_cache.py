@@ -0,0 +1,43 @@
+from database.project_data_cache import ProjectDataCache
+
+
+def test_get_caches_loaded_value():
+    cache = ProjectDataCache(ttl=60, max_size=2)
+    assert cache.get(1, lambda: "data") == "data"
+    assert cache.get(1, lambda: "other") == "data"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_get_does_not_cache_empty_value():
+    cache = ProjectDataCache(ttl=60, max_size=2)
+    assert cache.get(1, lambda: None) is None
+    assert len(cache) == 0
+
+def test_get_evicts_least_recently_used():
+    cache = ProjectDataCache(ttl=60, max_size=2)
+    cache.get(1, lambda: "one")
+    cache.get(2, lambda: "two")
+    cache.get(1, lambda: "one")
+    cache.get(3, lambda: "three")
+    assert cache.get(2, lambda: "reloaded") == "reloaded"
+
+def test_invalidate_during_load_skips_store():
+    cache = ProjectDataCache(ttl=60, max_size=2)
+
+    def stale_loader():
+        cache.invalidate(1) # The data changes while the loader reads it.
+        return "stale"
+
+    assert cache.get(1, stale_loader) == "stale"
+    assert len(cache) == 0
+    assert cache.get(1, lambda: "fresh") == "fresh"
+    assert cache.get(1, lambda: "other") == "fresh"
+
+def test_clear_during_load_skips_store():
+    cache = ProjectDataCache(ttl=60, max_size=2)
+
+    def stale_loader():
+        cache.clear()
+        return "stale"
+
+    cache.get(1, stale_loader)
+    assert len(cache) == 0
@@ -0,0 +1,152 @@
+from types import SimpleNamespace
+from werkzeug.test import EnvironBuilder
+
+from rag.scheduler import QueueFullError, Scheduler
+
+import asyncio
+import pytest
+
+
+def test_submit_admits_while_slots_are_free():
+    scheduler = Scheduler({"generation": (2, 4)})
+    first = scheduler.submit("generation")
+    second = scheduler.submit("generation")
+    third = scheduler.submit("generation")
+
+    assert first.admitted and second.admitted
+    assert not third.admitted
+    assert third.position() == 1
+    assert scheduler.lanes["generation"].active == 2
+
+def test_release_admits_queued_tickets_by_priority():
+    scheduler = Scheduler({"generation": (1, 4)})
+    active = scheduler.submit("generation")
+    low = scheduler.submit("generation", priority=1)
+    high = scheduler.submit("generation", priority=0)
+    assert (high.position(), low.position()) == (1, 2)
+
+    active.release()
+    assert high.admitted and not low.admitted
+    assert low.position() == 1
+
+    active.release() # Releasing twice does not free another slot.
+    assert not low.admitted
+    high.release()
+    assert low.admitted
+    low.release()
+    assert scheduler.lanes["generation"].active == 0
+
+def test_reserved_ticket_takes_slot_only_when_waited_for():
+    scheduler = Scheduler({"generation": (1, 4)})
+    reserved = scheduler.reserve("generation")
+    other = scheduler.submit("generation")
+    assert other.admitted
+    assert not reserved.admitted and reserved.position() == 0
+
+    positions = reserved.wait(poll_interval=0.01)
+    assert next(positions) == 1 # Entered the queue behind the admitted ticket.
+    assert scheduler.lanes["generation"].reserved == 0
+    other.release()
+    assert list(positions) == []
+    reserved.release()
+    assert scheduler.lanes["generation"].active == 0
+
+def test_reserve_counts_against_capacity():
+    scheduler = Scheduler({"generation": (1, 1)})
+    first = scheduler.reserve("generation")
+    scheduler.reserve("generation")
+    with pytest.raises(QueueFullError):
+        scheduler.reserve("generation")
+
+    first.release()
+    assert scheduler.lanes["generation"].reserved == 1
+    scheduler.reserve("generation")
+
+def test_release_removes_waiting_ticket_from_queue():
+    scheduler = Scheduler({"generation": (1, 4)})
+    active = scheduler.submit("generation")
+    waiting = scheduler.submit("generation")
+
+    waiting.release()
+    assert scheduler.lanes["generation"].queue == []
+    active.release()
+    assert not waiting.admitted
+    assert scheduler.lanes["generation"].active == 0
+
+def test_submit_raises_when_queue_is_full():
+    scheduler = Scheduler({"generation": (1, 1)})
+    scheduler.submit("generation")
+    scheduler.submit("generation")
+
+    with pytest.raises(QueueFullError) as error:
+        scheduler.submit("generation")
+    assert error.value.lane == "generation"
+    assert error.value.retry_after >= 1
+    assert len(scheduler.lanes["generation"].queue) == 1
+
+def test_wait_yields_queue_position_until_admitted():
+    scheduler = Scheduler({"generation": (1, 4)})
+    active = scheduler.submit("generation")
+    waiting = scheduler.submit("generation")
+
+    positions = waiting.wait(poll_interval=0.01)
+    assert next(positions) == 1
+    active.release()
+    assert list(positions) == []
+    assert waiting.admitted
+
+
+@pytest.fixture
+def chat_request(monkeypatch):
+    """Patches an app module to use a scheduler with one generation slot, and an answer pipeline which is never imported.
+
+    Returns:
+        Callable: Takes the app module, and returns the scheduler and the headers and body of a valid chat request.
+    """
+    def patch(app_module):
+        import api
+        scheduler = Scheduler({"generation": (1, 4)})
+        pipeline = SimpleNamespace(generate_response=lambda *args: iter(["Hi"]), agenerate_response=None)
+        monkeypatch.setattr(app_module, "scheduler", scheduler)
+        monkeypatch.setattr(app_module, "lazy_import", lambda name: pipeline)
+        monkeypatch.setattr(api.recent_projects, "touch", lambda project_id: None)
+        headers = {"Authorization": api.generate_jwt_token()}
+        return scheduler, headers, {"prompt": "Hi", "project_id": 1}
+    return patch
+
+def test_flask_stream_closed_before_start_releases_slot(chat_request):
+    import api
+    scheduler, headers, body = chat_request(api)
+
+    # Calls the WSGI app directly, since the test client reads the first chunk of the stream.
+    environ = EnvironBuilder("/chat", method="POST", headers=headers, json=body).get_environ()
+    app_iter = api.app(environ, lambda status, headers: None)
+    assert scheduler.lanes["generation"].reserved == 1
+    app_iter.close() # The server closes the response without reading it when the client has disconnected.
+    assert scheduler.lanes["generation"].reserved == 0
+
+def test_quart_stream_closed_before_start_releases_slot(chat_request):
+    import asgi
+    scheduler, headers, body = chat_request(asgi)
+
+    async def request_and_close():
+        async with asgi.app.test_request_context("/chat", method="POST", headers=headers, json=body):
+            response = await asgi.chatbot_endpoint()
+        assert scheduler.lanes["generation"].reserved == 1
+        async with response.response: # The server closes the body without sending it when the client has disconnected.
+            pass
+
+    asyncio.run(request_and_close())
+    assert scheduler.lanes["generation"].reserved == 0
+
+def test_failed_pipeline_import_takes_no_slot(chat_request, monkeypatch):
+    import api
+    scheduler, headers, body = chat_request(api)
+
+    def fail_import(name):
+        raise ImportError(name)
+
+    monkeypatch.setattr(api, "lazy_import", fail_import)
+    response = api.app.test_client().post("/chat", headers=headers, json=body)
+    assert response.status_code == 500
+    assert scheduler.lanes["generation"].active == 0
@@ -0,0 +1,25 @@
+from rag.warmup import RecentProjects
+
+import json
+
+
+def test_recent_projects_are_saved_and_loaded(tmp_path):
+    path = str(tmp_path / "recent_projects.json")
+    recent_projects = RecentProjects(path, max_size=2, save_interval=60)
+    for project_id in (1, 2, 1, 3):
+        recent_projects.touch(project_id)
+    recent_projects._saver.shutdown(wait=True) # Waits for the background saves.
+
+    assert recent_projects.most_recent(5) == [3, 1]
+    with open(path) as f:
+        assert json.load(f) == [1, 3]
+    assert RecentProjects(path, max_size=2, save_interval=60).most_recent(5) == [3, 1]
+
+def test_chat_request_normalises_project_id(monkeypatch):
+    import api
+    touched = []
+    monkeypatch.setattr(api.recent_projects, "touch", touched.append)
+
+    _, _, project_id = api.parse_chat_request(api.generate_jwt_token(), {"prompt": "Hi", "project_id": "7"})
+    assert project_id == 7
+    assert touched == [7]